@@ -5,9 +5,12 @@ from datetime import datetime
 from typing import Dict, List, Any
 import sys
 import os
+import uuid
 
-from nlu import understand_the_user
-from agent import retriever
+from pipeline import submit_query, PIPELINE_MODES, DEFAULT_PIPELINE_MODE
+from jobs import job_queue
+from telemetry import telemetry, trace_context
+from quota import quota_user, session_quota_user
 
 st.set_page_config(
     page_title="Inventory Management Assistant",
@@ -153,111 +156,129 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Messages rendered on every run, earlier ones are shown on request so render cost stays flat
+CHAT_WINDOW = 20
+# How often the UI polls a running query
+JOB_POLL_SECONDS = 0.5
+
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'is_processing' not in st.session_state:
     st.session_state.is_processing = False
 if 'current_status' not in st.session_state:
     st.session_state.current_status = ""
+if 'pipeline_mode' not in st.session_state:
+    st.session_state.pipeline_mode = DEFAULT_PIPELINE_MODE
+if 'session_id' not in st.session_state:
+    # Tags this browser session's telemetry spans
+    st.session_state.session_id = uuid.uuid4().hex
+if 'quota_user' not in st.session_state:
+    st.session_state.quota_user = session_quota_user(st.session_state.session_id)
+if 'active_job' not in st.session_state:
+    st.session_state.active_job = None
 
-def add_to_chat_history(message: str, sender: str, timestamp: str = None):
-    """Add a message to the chat history"""
-    if timestamp is None:
-        timestamp = datetime.now().strftime("%H:%M:%S")
-    
-    st.session_state.chat_history.append({
-        'message': message,
-        'sender': sender,
-        'timestamp': timestamp
-    })
-
-def display_typing_indicator():
-    """Display typing indicator animation with current status"""
-    status_text = st.session_state.current_status if st.session_state.current_status else "Processing..."
-    return f"""
-    <div class="message-row assistant">
-        <div class="chat-icon assistant-icon">🤖</div>
-        <div class="chat-message typing-indicator">
-            <div style="display: flex; align-items: center; gap: 10px;">
-                <div class="typing-dots">
-                    <div class="typing-dot"></div>
-                    <div class="typing-dot"></div>
-                    <div class="typing-dot"></div>
-                </div>
-                <span style="font-size: 0.9rem; color: #666;">{status_text}</span>
-            </div>
-        </div>
-    </div>
-    <div class="chat-timestamp">Working on it...</div>
-    """
-
-def display_chat_history():
-    """Display the chat history"""
-    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-    
-    for chat in st.session_state.chat_history:
-        if chat['sender'] == 'user':
-            st.markdown(f"""
+def render_message_html(message: str, sender: str, timestamp: str) -> str:
+    """Build the HTML of one chat message, done once when the message is added"""
+    if sender == 'user':
+        return f"""
             <div class="message-row user">
                 <div class="chat-message user-message">
-                    <div class="chat-text">{chat['message']}</div>
+                    <div class="chat-text">{message}</div>
                 </div>
                 <div class="chat-icon user-icon">👤</div>
             </div>
-            <div class="chat-timestamp">{chat['timestamp']}</div>
-            """, unsafe_allow_html=True)
-        else:
-            icon_class = "assistant-icon"
-            message_class = "assistant-message"
-            
-            if chat['message'].startswith('❌'):
-                message_class = "chat-message error-message"
-            
-            st.markdown(f"""
+            <div class="chat-timestamp">{timestamp}</div>
+            """
+    
+    message_class = "chat-message error-message" if message.startswith('❌') else "assistant-message"
+    return f"""
             <div class="message-row assistant">
-                <div class="chat-icon {icon_class}">🤖</div>
+                <div class="chat-icon assistant-icon">🤖</div>
                 <div class="chat-message {message_class}">
-                    <div class="chat-text">{chat['message']}</div>
+                    <div class="chat-text">{message}</div>
                 </div>
             </div>
-            <div class="chat-timestamp">{chat['timestamp']}</div>
-            """, unsafe_allow_html=True)
-    
-    if st.session_state.is_processing:
-        st.markdown(display_typing_indicator(), unsafe_allow_html=True)
+            <div class="chat-timestamp">{timestamp}</div>
+            """
+
+def add_to_chat_history(message: str, sender: str, timestamp: str = None):
+    """Add a message to the chat history with its rendered HTML"""
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%H:%M:%S")
     
-    st.markdown('</div>', unsafe_allow_html=True)
+    st.session_state.chat_history.append({
+        'message': message,
+        'sender': sender,
+        'timestamp': timestamp,
+        'html': render_message_html(message, sender, timestamp)
+    })
 
-def process_user_query(user_input: str) -> Dict[str, Any]:
-    """Process user query through NLU and Agent pipeline"""
-    result = {
-        'success': False,
-        'final_answer': None,
-        'error': None
-    }
+def display_message(index: int):
+    """Display one chat message from its cached HTML, in a container keyed by its position"""
+    with st.container(key=f"chat_message_{index}"):
+        st.markdown(st.session_state.chat_history[index]['html'], unsafe_allow_html=True)
+
+@st.fragment
+def display_earlier_messages(count: int):
+    """Older messages are only sent to the browser on request, toggling reruns just this fragment"""
+    if st.toggle(f"📜 Show {count} earlier messages", key="show_earlier_messages"):
+        for i in range(count):
+            display_message(i)
+
+def display_chat_history() -> int:
+    """Display the latest CHAT_WINDOW messages, returns how many messages are on screen"""
+    history = st.session_state.chat_history
+    earlier = max(0, len(history) - CHAT_WINDOW)
+    if earlier:
+        display_earlier_messages(earlier)
+    for i in range(earlier, len(history)):
+        display_message(i)
+    return len(history)
+
+def start_query(user_text: str):
+    """Add the question to the chat and answer it in the background job pool"""
+    add_to_chat_history(user_text, "user")
+    with trace_context(session_id=st.session_state.session_id, query=user_text), quota_user(st.session_state.quota_user):
+        st.session_state.active_job = submit_query(user_text, mode=st.session_state.pipeline_mode)
+    st.session_state.is_processing = True
+
+def finish_query(job: Dict[str, Any]):
+    """Move a finished job's answer (or error) into the chat history"""
+    result = job['result'] if job else None
+    if job is None:
+        add_to_chat_history("❌ Error: The request was lost, please ask again.", "assistant")
+    elif job['status'] == 'cancelled':
+        add_to_chat_history("❌ Request cancelled.", "assistant")
+    elif result is not None and result['success']:
+        add_to_chat_history(result['final_answer'], "assistant")
+    else:
+        error_msg = (result or {}).get('error') or job['error'] or "Something went wrong. Please try again."
+        add_to_chat_history(f"❌ Error: {error_msg}", "assistant")
     
-    try:
-        # Natural Language Understanding
-        nlu_response = understand_the_user(user_input)
-        
-        if nlu_response is None:
-            result['error'] = "Failed to understand your request. Please try again."
-            return result
-        
-        # Agent Processing
-        agent_response = retriever(nlu_response.user_intent)
-        
-        if agent_response is None:
-            result['error'] = "Failed to retrieve data from inventory. Please try again."
-            return result
-        
-        result['final_answer'] = agent_response.paraphrased_output
-        result['success'] = True
-        
-    except Exception as e:
-        result['error'] = f"Error in processing: {str(e)}"
+    if job is not None:
+        job_queue.forget(job['id'])
+    st.session_state.active_job = None
+    st.session_state.is_processing = False
+    st.session_state.current_status = ""
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def display_active_job():
+    """Poll the running query: status and streamed answer so far, with a cancel button"""
+    job_id = st.session_state.active_job
+    if job_id is None:
+        return
+    job = job_queue.status(job_id)
+    if job is None or job['status'] in ('done', 'failed', 'cancelled'):
+        finish_query(job)
+        # Full rerun: the answer joins the history and the input is enabled again
+        st.rerun()
     
-    return result
+    st.session_state.current_status = job['progress']
+    st.caption(f"🔍 {job['progress']} ({job['elapsed']:.0f}s)")
+    if job['text']:
+        st.markdown(job['text'])
+    if st.button("⏹️ Cancel", key=f"cancel_{job_id}"):
+        job_queue.cancel(job_id)
 
 def main():
     """Main Streamlit application"""
@@ -268,14 +289,34 @@ def main():
         st.markdown("### 🛠️ Controls")
         
         if st.button("🗑️ Clear Chat History"):
+            if st.session_state.active_job is not None:
+                job_queue.cancel(st.session_state.active_job)
+                st.session_state.active_job = None
             st.session_state.chat_history = []
             st.session_state.is_processing = False
             st.session_state.current_status = ""
             st.rerun()
         
+        st.session_state.pipeline_mode = st.selectbox(
+            "Pipeline Mode",
+            options=list(PIPELINE_MODES.keys()),
+            format_func=lambda x: PIPELINE_MODES[x],
+            index=list(PIPELINE_MODES.keys()).index(st.session_state.pipeline_mode),
+            help="Lean mode merges understanding and tool selection into one call and formats the answer locally"
+        )
+
         st.markdown("### 📋 System Info")
         st.info(f"**Chat Messages:** {int(len(st.session_state.chat_history)/2)}")
         
+        with st.expander("### ⏱️ Latency (p50 / p95)"):
+            latency = telemetry.percentiles()
+            if latency:
+                st.table([{'Stage': stage, 'Requests': stats['count'],
+                           'p50 (ms)': round(stats['p50_ms']), 'p95 (ms)': round(stats['p95_ms'])}
+                          for stage, stats in latency.items()])
+            else:
+                st.caption("No requests timed yet.")
+
         st.markdown("### 💡 Sample Queries")
         st.markdown("""
         - "What is the total count of Bonderite 6278?"
@@ -284,12 +325,15 @@ def main():
 
     st.markdown("### 💬 Chat")
     
-    if st.session_state.chat_history or st.session_state.is_processing:
-        chat_container = st.container()
-        with chat_container:
-            display_chat_history()
-    else:
-        st.info("👋 Welcome! Ask me anything about your inventory data.")
+    # Messages added later in this run are appended to this container, no rerun needed to show them
+    chat_container = st.container()
+    with chat_container:
+        welcome = st.empty()
+        if st.session_state.chat_history:
+            rendered_count = display_chat_history()
+        else:
+            rendered_count = 0
+            welcome.info("👋 Welcome! Ask me anything about your inventory data.")
     
     st.markdown("---")
     
@@ -309,25 +353,16 @@ def main():
         )
     
     if submit_button and user_input.strip() and not st.session_state.is_processing:
-        add_to_chat_history(user_input, "user")
-        st.session_state.is_processing = True
-        st.rerun()
+        # Answered in the background, the script run (and the page) stays responsive
+        start_query(user_input)
     
-    if st.session_state.is_processing:
-        latest_message = st.session_state.chat_history[-1]['message']
-        
-        result = process_user_query(latest_message)
-        
-        if result['success']:
-            add_to_chat_history(result['final_answer'], "assistant")
-        else:
-            error_msg = result['error'] or "Something went wrong. Please try again."
-            add_to_chat_history(f"❌ Error: {error_msg}", "assistant")
-        
-        st.session_state.is_processing = False
-        st.session_state.current_status = ""
-        
-        st.rerun()
+    # Show the question queued in this run, then follow the running query in the chat
+    if st.session_state.active_job is not None:
+        with chat_container:
+            welcome.empty()
+            for i in range(rendered_count, len(st.session_state.chat_history)):
+                display_message(i)
+            display_active_job()
     
     # Footer
     st.markdown("---")
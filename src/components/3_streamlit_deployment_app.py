@@ -5,30 +5,22 @@ from datetime import datetime
 from typing import Dict, List, Any
 import sys
 import os
-import base64
+import uuid
 import io
 
 # Voice-related imports
-try:
-    import pyttsx3
-    PYTTSX3_AVAILABLE = True
-except ImportError:
-    PYTTSX3_AVAILABLE = False
-
-try:
-    from gtts import gTTS
-    GTTS_AVAILABLE = True
-except ImportError:
-    GTTS_AVAILABLE = False
-
 try:
     import speech_recognition as sr
     SPEECH_RECOGNITION_AVAILABLE = True
 except ImportError:
     SPEECH_RECOGNITION_AVAILABLE = False
 
-from nlu import understand_the_user
-from agent import retriever
+from pipeline import submit_query, PIPELINE_MODES, DEFAULT_PIPELINE_MODE
+from jobs import job_queue
+from telemetry import telemetry, trace_context
+from quota import quota, quota_user, QuotaExceeded, PRESSURE_THRESHOLD, session_quota_user
+from stt_backends import get_stt_backend, NoSpeechError
+from tts import AUDIO_FORMATS, GTTS_AVAILABLE, PYTTSX3_AVAILABLE, synthesize, synthesize_chunked
 
 st.set_page_config(
     page_title="Inventory Management Assistant",
@@ -302,6 +294,11 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Messages rendered on every run, earlier ones are shown on request so render cost stays flat
+CHAT_WINDOW = 20
+# How often the UI polls a running query
+JOB_POLL_SECONDS = 0.5
+
 # Initialize session state
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
@@ -309,6 +306,22 @@ if 'is_processing' not in st.session_state:
     st.session_state.is_processing = False
 if 'current_status' not in st.session_state:
     st.session_state.current_status = ""
+if 'pipeline_mode' not in st.session_state:
+    st.session_state.pipeline_mode = DEFAULT_PIPELINE_MODE
+if 'session_id' not in st.session_state:
+    # Tags this browser session's telemetry spans
+    st.session_state.session_id = uuid.uuid4().hex
+if 'quota_user' not in st.session_state:
+    st.session_state.quota_user = session_quota_user(st.session_state.session_id)
+if 'active_job' not in st.session_state:
+    st.session_state.active_job = None
+if 'autoplay_index' not in st.session_state:
+    st.session_state.autoplay_index = None
+if 'autoplay_start' not in st.session_state:
+    st.session_state.autoplay_start = 0.0
+if 'playback' not in st.session_state:
+    # Sentence-by-sentence playback of the running job's answer
+    st.session_state.playback = None
 if 'voice_enabled' not in st.session_state:
     st.session_state.voice_enabled = True
 if 'voice_method' not in st.session_state:
@@ -328,106 +341,64 @@ if 'auto_send_voice' not in st.session_state:
 if 'audio_processed' not in st.session_state:
     st.session_state.audio_processed = False
 
-def text_to_speech_gtts(text: str) -> str:
+def show_voice_error(message: str):
+    st.markdown(f"<p style='color: red;'>{message}</p>", unsafe_allow_html=True)
+
+def text_to_speech_gtts(text: str) -> bytes:
     """Generate audio using Google Text-to-Speech"""
     if not GTTS_AVAILABLE:
-        return "<p style='color: red;'>gTTS not available. Install with: pip install gtts</p>"
+        show_voice_error("gTTS not available. Install with: pip install gtts")
+        return None
     
     try:
-        # Clean text for speech
-        clean_text = text.replace("❌", "Error:").replace("✅", "Success:").replace("📦", "").replace("🤖", "")
-        
-        # Generate speech
-        tts = gTTS(text=clean_text, lang='en', slow=False)
-        
-        # Save to BytesIO buffer
-        audio_buffer = io.BytesIO()
-        tts.write_to_fp(audio_buffer)
-        audio_buffer.seek(0)
-        
-        # Encode to base64 for embedding
-        audio_base64 = base64.b64encode(audio_buffer.read()).decode()
-        
-        # Create HTML audio player
-        audio_html = f"""
-        <audio {'autoplay' if st.session_state.auto_play_voice else ''} controls style="width: 100%; max-width: 300px;">
-            <source src="data:audio/mp3;base64,{audio_base64}" type="audio/mp3">
-            Your browser does not support the audio element.
-        </audio>
-        """
-        
-        return audio_html
+        # Generate speech, sentences are synthesized in parallel
+        return synthesize_chunked(text, "gtts")
         
     except Exception as e:
-        return f"<p style='color: red;'>Error generating speech: {str(e)}</p>"
+        show_voice_error(f"Error generating speech: {str(e)}")
+        return None
 
-def text_to_speech_pyttsx3(text: str) -> str:
+def text_to_speech_pyttsx3(text: str) -> bytes:
     """Generate audio using pyttsx3 (offline)"""
     if not PYTTSX3_AVAILABLE:
-        return "<p style='color: red;'>pyttsx3 not available. Install with: pip install pyttsx3</p>"
+        show_voice_error("pyttsx3 not available. Install with: pip install pyttsx3")
+        return None
     
     try:
-        # Clean text for speech
-        clean_text = text.replace("❌", "Error:").replace("✅", "Success:").replace("📦", "").replace("🤖", "")
-        
-        # Initialize TTS engine
-        engine = pyttsx3.init()
-        
-        # Configure voice settings
-        engine.setProperty('rate', 150)    # Speed of speech
-        engine.setProperty('volume', 0.9)  # Volume level (0.0 to 1.0)
-        
-        # Try to set a good voice
-        voices = engine.getProperty('voices')
-        if voices:
-            # Prefer female voice if available
-            for voice in voices:
-                if 'male' in voice.name.lower() or 'david' in voice.name.lower():
-                    engine.setProperty('voice', voice.id)
-                    break
-        
-        # Save to temporary file
-        temp_audio_path = "temp_speech.wav"
-        engine.save_to_file(clean_text, temp_audio_path)
-        engine.runAndWait()
-        
-        # Read and encode the audio file
-        if os.path.exists(temp_audio_path):
-            with open(temp_audio_path, "rb") as audio_file:
-                audio_base64 = base64.b64encode(audio_file.read()).decode()
-            
-            # Clean up temp file
-            os.remove(temp_audio_path)
-            
-            # Create HTML audio player
-            audio_html = f"""
-            <audio {'autoplay' if st.session_state.auto_play_voice else ''} controls style="width: 100%; max-width: 300px;">
-                <source src="data:audio/wav;base64,{audio_base64}" type="audio/wav">
-                Your browser does not support the audio element.
-            </audio>
-            """
-            
-            return audio_html
-        else:
-            return "<p style='color: red;'>Failed to generate audio file</p>"
+        audio_bytes = synthesize(text, "pyttsx3")
+        if not audio_bytes:
+            show_voice_error("Failed to generate audio file")
+        return audio_bytes
             
     except Exception as e:
-        return f"<p style='color: red;'>Error with offline TTS: {str(e)}</p>"
+        show_voice_error(f"Error with offline TTS: {str(e)}")
+        return None
 
-def generate_voice_output(text: str) -> str:
-    """Generate voice output based on selected method"""
+def synthesize_voice_output(text: str) -> Dict[str, Any]:
+    """Synthesize an answer once with the selected method, returns {'method', 'bytes'} or None"""
     if not st.session_state.voice_enabled or st.session_state.voice_method == "disabled":
-        return ""
+        return None
     
-    if st.session_state.voice_method == "gtts":
-        return text_to_speech_gtts(text)
-    elif st.session_state.voice_method == "pyttsx3":
-        return text_to_speech_pyttsx3(text)
-    
-    return ""
+    voice_method = st.session_state.voice_method
+    if voice_method == "gtts":
+        audio_bytes = text_to_speech_gtts(text)
+    elif voice_method == "pyttsx3":
+        audio_bytes = text_to_speech_pyttsx3(text)
+    else:
+        return None
+    return {'method': voice_method, 'bytes': audio_bytes} if audio_bytes else None
+
+def play_voice_output(audio: Dict[str, Any], autoplay: bool = False, start_time: float = 0.0):
+    """Play the audio stored with a chat message, nothing is synthesized here"""
+    if not audio or not audio['bytes'] or not st.session_state.voice_enabled or st.session_state.voice_method == "disabled":
+        return
+    
+    # Streamlit keeps the bytes in its media file manager and serves them by URL
+    # (with range requests), so the page only carries a reference, not the audio
+    st.audio(audio['bytes'], format=AUDIO_FORMATS[audio['method']], autoplay=autoplay, start_time=start_time)
 
 def speech_to_text_audio_input(audio_file) -> str:
-    """Generate speech recognition using streamlit audio input and speech_recognition library"""
+    """Generate speech recognition for streamlit audio input with the configured STT backend"""
     if not SPEECH_RECOGNITION_AVAILABLE:
         return "speech_recognition not available. Install with: pip install SpeechRecognition"
     
@@ -435,131 +406,175 @@ def speech_to_text_audio_input(audio_file) -> str:
         return "No audio data received"
     
     try:
-        # Initialize recognizer
-        r = sr.Recognizer()
-        
-        # Use the UploadedFile directly as a file-like object
-        with sr.AudioFile(audio_file) as source:
-            # Read the audio data
-            audio_data = r.record(source)
-            
-            # Recognize speech using Google Web Speech API
-            try:
-                text = r.recognize_google(audio_data)
-                return text
-            except sr.UnknownValueError:
-                return "Could not understand the audio. Please try again."
-            except sr.RequestError as e:
-                return f"Error with speech recognition service: {e}"
-                
+        # The UploadedFile is passed straight to the deployment's STT backend (STT_BACKEND)
+        return get_stt_backend().transcribe(audio_file).text
+    except NoSpeechError:
+        return "Could not understand the audio. Please try again."
+    except QuotaExceeded as e:
+        return f"Could not transcribe right now, speech recognition is busy. Please try again in about {max(1, round(e.retry_after))} seconds or type your question."
+    except sr.RequestError as e:
+        return f"Error with speech recognition service: {e}"
     except Exception as e:
         return f"Error processing audio: {str(e)}"
 
-def add_to_chat_history(message: str, sender: str, timestamp: str = None):
-    """Add a message to the chat history"""
-    if timestamp is None:
-        timestamp = datetime.now().strftime("%H:%M:%S")
-    
-    st.session_state.chat_history.append({
-        'message': message,
-        'sender': sender,
-        'timestamp': timestamp
-    })
-
-def display_typing_indicator():
-    """Display typing indicator animation with current status"""
-    status_text = st.session_state.current_status if st.session_state.current_status else "Processing..."
-    return f"""
-    <div class="message-row assistant">
-        <div class="chat-icon assistant-icon">🤖</div>
-        <div class="chat-message typing-indicator">
-            <div style="display: flex; align-items: center; gap: 10px;">
-                <div class="typing-dots">
-                    <div class="typing-dot"></div>
-                    <div class="typing-dot"></div>
-                    <div class="typing-dot"></div>
-                </div>
-                <span style="font-size: 0.9rem; color: #666;">{status_text}</span>
-            </div>
-        </div>
-    </div>
-    <div class="chat-timestamp">Working on it...</div>
-    """
-
-def display_chat_history():
-    """Display the chat history with voice support"""
-    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-    
-    for i, chat in enumerate(st.session_state.chat_history):
-        if chat['sender'] == 'user':
-            st.markdown(f"""
+def render_message_html(message: str, sender: str, timestamp: str) -> str:
+    """Build the HTML of one chat message, done once when the message is added"""
+    if sender == 'user':
+        return f"""
             <div class="message-row user">
                 <div class="chat-message user-message">
-                    <div class="chat-text">{chat['message']}</div>
+                    <div class="chat-text">{message}</div>
                 </div>
                 <div class="chat-icon user-icon">👤</div>
             </div>
-            <div class="chat-timestamp">{chat['timestamp']}</div>
-            """, unsafe_allow_html=True)
-        else:
-            icon_class = "assistant-icon"
-            message_class = "assistant-message"
-            
-            if chat['message'].startswith('❌'):
-                message_class = "chat-message error-message"
-            
-            st.markdown(f"""
+            <div class="chat-timestamp">{timestamp}</div>
+            """
+    
+    message_class = "chat-message error-message" if message.startswith('❌') else "assistant-message"
+    return f"""
             <div class="message-row assistant">
-                <div class="chat-icon {icon_class}">🤖</div>
+                <div class="chat-icon assistant-icon">🤖</div>
                 <div class="chat-message {message_class}">
-                    <div class="chat-text">{chat['message']}</div>
+                    <div class="chat-text">{message}</div>
                 </div>
             </div>
-            <div class="chat-timestamp">{chat['timestamp']}</div>
-            """, unsafe_allow_html=True)
-            
-            # Add voice output for assistant messages
-            if st.session_state.voice_enabled and chat['sender'] == 'assistant':
-                voice_html = generate_voice_output(chat['message'])
-                if voice_html:
-                    st.markdown(f'<div style="margin-left: 40px; margin-top: 5px;">{voice_html}</div>', 
-                              unsafe_allow_html=True)
+            <div class="chat-timestamp">{timestamp}</div>
+            """
+
+def add_to_chat_history(message: str, sender: str, timestamp: str = None, audio: Dict[str, Any] = None):
+    """Add a message to the chat history with its synthesized voice ({'method', 'bytes'}) and rendered HTML"""
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%H:%M:%S")
     
-    if st.session_state.is_processing:
-        st.markdown(display_typing_indicator(), unsafe_allow_html=True)
+    # Assistant messages are voiced once here, reruns only replay the stored audio
+    if sender == 'assistant' and audio is None:
+        audio = synthesize_voice_output(message)
     
-    st.markdown('</div>', unsafe_allow_html=True)
+    st.session_state.chat_history.append({
+        'message': message,
+        'sender': sender,
+        'timestamp': timestamp,
+        'audio': audio,
+        'html': render_message_html(message, sender, timestamp)
+    })
 
-def process_user_query(user_input: str) -> Dict[str, Any]:
-    """Process user query through NLU and Agent pipeline"""
-    result = {
-        'success': False,
-        'final_answer': None,
-        'error': None
-    }
+def display_message(index: int, autoplay: bool = False, start_time: float = 0.0):
+    """Display one chat message from its cached HTML, in a container keyed by its position"""
+    chat = st.session_state.chat_history[index]
+    with st.container(key=f"chat_message_{index}"):
+        st.markdown(chat['html'], unsafe_allow_html=True)
+        if st.session_state.voice_enabled and chat['sender'] == 'assistant':
+            play_voice_output(chat.get('audio'), autoplay=autoplay, start_time=start_time)
+
+@st.fragment
+def display_earlier_messages(count: int):
+    """Older messages are only sent to the browser on request, toggling reruns just this fragment"""
+    if st.toggle(f"📜 Show {count} earlier messages", key="show_earlier_messages"):
+        for i in range(count):
+            display_message(i)
+
+def display_chat_history() -> int:
+    """Display the latest CHAT_WINDOW messages, returns how many messages are on screen"""
+    history = st.session_state.chat_history
+    earlier = max(0, len(history) - CHAT_WINDOW)
+    if earlier:
+        display_earlier_messages(earlier)
+    for i in range(earlier, len(history)):
+        display_message(i, autoplay=st.session_state.auto_play_voice and i == st.session_state.autoplay_index,
+                        start_time=st.session_state.autoplay_start)
+    # A new answer auto-plays once, not again on later reruns
+    st.session_state.autoplay_index = None
+    st.session_state.autoplay_start = 0.0
+    return len(history)
+
+def start_query(user_text: str):
+    """Add the question to the chat and answer it in the background job pool"""
+    add_to_chat_history(user_text, 'user')
+    voice_method = st.session_state.voice_method if st.session_state.voice_enabled else None
+    with trace_context(session_id=st.session_state.session_id, query=user_text), quota_user(st.session_state.quota_user):
+        st.session_state.active_job = submit_query(user_text, mode=st.session_state.pipeline_mode, voice_method=voice_method)
+    st.session_state.is_processing = True
+    st.session_state.current_status = "Understanding your request..."
+
+def finish_query(job: Dict[str, Any]):
+    """Move a finished job's answer (or error) into the chat history"""
+    result = job['result'] if job else None
+    if job is None:
+        add_to_chat_history("❌ The request was lost, please ask again.", 'assistant')
+    elif job['status'] == 'cancelled':
+        add_to_chat_history("❌ Request cancelled.", 'assistant')
+    elif result is None:
+        add_to_chat_history(f"❌ An error occurred while processing your request: {job['error']}", 'assistant')
+    elif result['success']:
+        add_to_chat_history(f"{result['final_answer']}", 'assistant', audio=result['audio'])
+        st.session_state.autoplay_index = len(st.session_state.chat_history) - 1
+        # Carries on from where the sentence-by-sentence playback got to
+        st.session_state.autoplay_start = playback_position(job['id'])
+    elif result['stage'] == 'quota':
+        add_to_chat_history(f"⏳ {result['error']}", 'assistant')
+    elif result['stage'] == 'nlu':
+        add_to_chat_history("❌ I couldn't understand your request. Please try rephrasing your question.", 'assistant')
+    else:
+        add_to_chat_history("❌ I couldn't retrieve the requested data from the inventory system. Please try again.", 'assistant')
     
-    try:
-        # Natural Language Understanding
-        nlu_response = understand_the_user(user_input)
-        
-        if nlu_response is None:
-            result['error'] = "Failed to understand your request. Please try again."
-            return result
-        
-        # Agent Processing
-        agent_response = retriever(nlu_response.user_intent)
-        
-        if agent_response is None:
-            result['error'] = "Failed to retrieve data from inventory. Please try again."
-            return result
-        
-        result['final_answer'] = agent_response.paraphrased_output
-        result['success'] = True
-        
-    except Exception as e:
-        result['error'] = f"Error in processing: {str(e)}"
+    if job is not None:
+        job_queue.forget(job['id'])
+    st.session_state.active_job = None
+    st.session_state.playback = None
+    st.session_state.is_processing = False
+    st.session_state.current_status = ""
+
+def playback_position(job_id: str) -> float:
+    """Seconds of the answer already played while the job was running"""
+    playback = st.session_state.playback
+    if playback is None or playback['job'] != job_id:
+        return 0.0
+    position = playback['offset']
+    if playback['started'] is not None:
+        position += time.time() - playback['started']
+    return position
+
+def play_job_audio(job: Dict[str, Any]):
+    """Play the answer's sentences one after another as the job synthesizes them"""
+    playback = st.session_state.playback
+    if playback is None or playback['job'] != job['id']:
+        playback = st.session_state.playback = {'job': job['id'], 'index': 0, 'started': None, 'offset': 0.0}
+    chunks = job['audio']
+    now = time.time()
+    while playback['index'] < len(chunks):
+        chunk = chunks[playback['index']]
+        if playback['started'] is None:
+            playback['started'] = now
+        if now - playback['started'] < chunk['seconds']:
+            break
+        # Finished playing, move on to the next sentence
+        playback['offset'] += chunk['seconds']
+        playback['index'] += 1
+        playback['started'] = None
+    if playback['index'] < len(chunks):
+        # Re-rendered unchanged on every poll, so the browser keeps playing it
+        st.audio(chunks[playback['index']]['bytes'], format=AUDIO_FORMATS[st.session_state.voice_method], autoplay=True)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def display_active_job():
+    """Poll the running query: status and streamed answer so far, with a cancel button"""
+    job_id = st.session_state.active_job
+    if job_id is None:
+        return
+    job = job_queue.status(job_id)
+    if job is None or job['status'] in ('done', 'failed', 'cancelled'):
+        finish_query(job)
+        # Full rerun: the answer joins the history and the input is enabled again
+        st.rerun()
     
-    return result
+    st.session_state.current_status = job['progress']
+    st.caption(f"🔍 {job['progress']} ({job['elapsed']:.0f}s)")
+    if job['text']:
+        st.markdown(job['text'])
+    if st.session_state.voice_enabled and st.session_state.auto_play_voice and job['audio']:
+        play_job_audio(job)
+    if st.button("⏹️ Cancel", key=f"cancel_{job_id}"):
+        job_queue.cancel(job_id)
 
 def main():
     """Main Streamlit application"""
@@ -570,6 +585,9 @@ def main():
         st.markdown("### 🛠️ Controls")
         
         if st.button("🗑️ Clear Chat History"):
+            if st.session_state.active_job is not None:
+                job_queue.cancel(st.session_state.active_job)
+                st.session_state.active_job = None
             st.session_state.chat_history = []
             st.session_state.is_processing = False
             st.session_state.current_status = ""
@@ -577,6 +595,14 @@ def main():
             st.session_state.audio_processed = False
             st.rerun()
         
+        st.session_state.pipeline_mode = st.selectbox(
+            "Pipeline Mode",
+            options=list(PIPELINE_MODES.keys()),
+            format_func=lambda x: PIPELINE_MODES[x],
+            index=list(PIPELINE_MODES.keys()).index(st.session_state.pipeline_mode),
+            help="Lean mode merges understanding and tool selection into one call and formats the answer locally"
+        )
+
         with st.expander("### 🎤 Voice Settings"):
 
             st.markdown("### 🔊 Voice Input Settings")
@@ -635,22 +661,37 @@ def main():
         
         st.markdown("### 📋 System Info")
 
-        chat_count = int(len(st.session_state.chat_history)/2) if st.session_state.chat_history else 0
-        if chat_count == 0:
-            st.success("✅ Welcome! You have 5 messages available this session.")
-        elif chat_count < 3:
-            st.info(f"💡 {5-chat_count} messages remaining. Make them count!")
-        elif chat_count < 5:
-            st.warning(f"⚡ Only {5-chat_count} messages left in this session.")
+        # API budgets are shared token buckets that refill continuously, there is no per-session cap
+        pressure = quota.pressure(st.session_state.quota_user)
+        if pressure < PRESSURE_THRESHOLD:
+            st.success("✅ Ready! Ask as many questions as you like.")
+        elif pressure < 1:
+            st.warning("⚡ High demand right now, answers may take a little longer.")
         else:
-            st.error("🛑 Session limit reached. Please refresh for a new session.")
+            st.error("🛑 At capacity, new questions wait for a free slot. Common questions are still answered instantly.")
         
-        st.info(f"**Chat Messages** : **{int(len(st.session_state.chat_history)/2) if st.session_state.chat_history else 0}**\n\nDue to API Limits, we are allowing only 5 messages per session. Thank You! 😊")
+        st.info(f"**Chat Messages** : **{int(len(st.session_state.chat_history)/2) if st.session_state.chat_history else 0}**")
         if st.session_state.voice_input_enabled:
             st.info(f"**Voice Input:** {VOICE_INPUT_OPTIONS[st.session_state.voice_input_method]}")
         if st.session_state.voice_enabled:
             st.info(f"**Voice Output:** {VOICE_OPTIONS[st.session_state.voice_method]}")
         
+        with st.expander("### 📊 API Budget"):
+            usage = quota.usage(st.session_state.quota_user)
+            st.table([{'Resource': resource.replace('_', ' ').title(), 'You (% used)': round(levels['user'] * 100),
+                       'Everyone (% used)': round(levels['global'] * 100)}
+                      for resource, levels in usage.items()])
+            st.caption("Budgets refill continuously, a full bucket lasts one minute of heavy use.")
+
+        with st.expander("### ⏱️ Latency (p50 / p95)"):
+            latency = telemetry.percentiles()
+            if latency:
+                st.table([{'Stage': stage, 'Requests': stats['count'],
+                           'p50 (ms)': round(stats['p50_ms']), 'p95 (ms)': round(stats['p95_ms'])}
+                          for stage, stats in latency.items()])
+            else:
+                st.caption("No requests timed yet.")
+
         st.markdown("### 💡 Sample Queries")
         st.markdown("""
         - "What is the total count of Bonderite 6278?"
@@ -659,12 +700,15 @@ def main():
 
     st.markdown("### 💬 Chat")
     
-    if st.session_state.chat_history or st.session_state.is_processing:
-        chat_container = st.container()
-        with chat_container:
-            display_chat_history()
-    else:
-        st.info("👋 Welcome! Ask me anything about your inventory data using text or voice input.")
+    # Messages added later in this run are appended to this container, no rerun needed to show them
+    chat_container = st.container()
+    with chat_container:
+        welcome = st.empty()
+        if st.session_state.chat_history:
+            rendered_count = display_chat_history()
+        else:
+            rendered_count = 0
+            welcome.info("👋 Welcome! Ask me anything about your inventory data using text or voice input.")
     
     st.markdown("---")
     
@@ -681,17 +725,15 @@ def main():
                 st.session_state.audio_processed = True  # Mark as processing
                 
                 with st.spinner("🔄 Processing speech..."):
-                    recognized_text = speech_to_text_audio_input(audio_file)
+                    with trace_context(session_id=st.session_state.session_id), quota_user(st.session_state.quota_user):
+                        recognized_text = speech_to_text_audio_input(audio_file)
                     if recognized_text and not recognized_text.startswith("Error") and not recognized_text.startswith("Could not") and not recognized_text.startswith("speech_recognition"):
                         st.session_state.recognized_text = recognized_text
                         st.success(f"🎤 Recognized: '{recognized_text}'")
                         
                         # Auto-send if checkbox is enabled
-                        if st.session_state.auto_send_voice:
-                            st.session_state.is_processing = True
-                            st.session_state.current_status = "Understanding your request..."
-                            add_to_chat_history(recognized_text, 'user')
-                            st.rerun()
+                        if st.session_state.auto_send_voice and not st.session_state.is_processing:
+                            start_query(recognized_text)
                     else:
                         st.error(f"🎤 {recognized_text}")
             
@@ -706,21 +748,14 @@ def main():
         # Use recognized text if available
         default_text = st.session_state.recognized_text if st.session_state.recognized_text else ""
 
-        if chat_count>=5:
-            st.error("🚫 **Message limit reached!** Please start a new session.")
-            user_input = st.text_area(
-                'API LIMIT REACHED',
-                disabled=True
-            )
-        else:
-            user_input = st.text_area(
-                "Type your question or use voice input above:",
-                value=default_text,
-                height=100,
-                key="recognized-text",
-                placeholder="e.g., 'What is the total count of Bonderite 6278?' or 'Show me top 5 products in R&D department'",
-                disabled=st.session_state.is_processing
-            )
+        user_input = st.text_area(
+            "Type your question or use voice input above:",
+            value=default_text,
+            height=100,
+            key="recognized-text",
+            placeholder="e.g., 'What is the total count of Bonderite 6278?' or 'Show me top 5 products in R&D department'",
+            disabled=st.session_state.is_processing
+        )
         
         submit_button = st.form_submit_button(
             "💬 Send Message",
@@ -733,77 +768,16 @@ def main():
     
     # Process user input
     if submit_button and user_input.strip() and not st.session_state.is_processing:
-        # Set processing state
-        st.session_state.is_processing = True
-        st.session_state.current_status = "Understanding your request..."
-        
-        # Add user message to chat
-        add_to_chat_history(user_input.strip(), 'user')
-        
-        # Rerun to show user message and typing indicator
-        st.rerun()
+        # Answered in the background, the script run (and the page) stays responsive
+        start_query(user_input.strip())
     
-    # Process the query if we're in processing state
-    if st.session_state.is_processing and st.session_state.chat_history:
-        # Get the last user message
-        last_message = None
-        for msg in reversed(st.session_state.chat_history):
-            if msg['sender'] == 'user':
-                last_message = msg['message']
-                break
-        
-        if last_message:
-            try:
-                # Update status for NLU processing
-                st.session_state.current_status = "Understanding your request..."
-                
-                # Process through NLU pipeline
-                with st.spinner("🧠 Understanding your request..."):
-                    time.sleep(0.5)  # Brief delay for UI feedback
-                    nlu_response = understand_the_user(last_message)
-                
-                if nlu_response is None:
-                    error_message = "❌ I couldn't understand your request. Please try rephrasing your question."
-                    add_to_chat_history(error_message, 'assistant')
-                    st.session_state.is_processing = False
-                    st.session_state.current_status = ""
-                    st.rerun()
-                    return
-                
-                # Update status for agent processing
-                st.session_state.current_status = "Searching inventory database..."
-                
-                # Process through Agent pipeline
-                with st.spinner("🔍 Searching inventory database..."):
-                    time.sleep(0.5)  # Brief delay for UI feedback
-                    agent_response = retriever(nlu_response.user_intent)
-                
-                if agent_response is None:
-                    error_message = "❌ I couldn't retrieve the requested data from the inventory system. Please try again."
-                    add_to_chat_history(error_message, 'assistant')
-                    st.session_state.is_processing = False
-                    st.session_state.current_status = ""
-                    st.rerun()
-                    return
-                
-                # Update status for final processing
-                st.session_state.current_status = "Preparing response..."
-                time.sleep(0.3)  # Brief delay for final processing
-                
-                # Add successful response to chat
-                success_message = f"{agent_response.paraphrased_output}"
-                add_to_chat_history(success_message, 'assistant')
-                
-            except Exception as e:
-                # Handle any unexpected errors
-                error_message = f"❌ An error occurred while processing your request: {str(e)}"
-                add_to_chat_history(error_message, 'assistant')
-            
-            finally:
-                # Reset processing state
-                st.session_state.is_processing = False
-                st.session_state.current_status = ""
-                st.rerun()
+    # Show the question queued in this run, then follow the running query in the chat
+    if st.session_state.active_job is not None:
+        with chat_container:
+            welcome.empty()
+            for i in range(rendered_count, len(st.session_state.chat_history)):
+                display_message(i)
+            display_active_job()
 
     # Quick action buttons
     st.markdown("### 🚀 Quick Actions")
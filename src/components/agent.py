@@ -1,82 +1,213 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_experimental.agents import create_pandas_dataframe_agent
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain.agents.agent_types import AgentType
 from langchain_core.tools import tool
+from langchain_core.callbacks import BaseCallbackHandler
 from pydantic import Field, BaseModel
 import pandas as pd
-from config import get_secret, where_is_it_running
+from config import where_is_it_running
+from inventory import inventory_store
+from answer_cache import answer_cache
+from retry import call_with_retry, acall_with_retry, LLM_POLICY
+from llm_clients import get_llm
+from telemetry import span, record_span
 import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
 
-llm = ChatGoogleGenerativeAI(
-    model='gemini-2.0-flash',
-    temperature=0,
-    api_key=get_secret("GEMINI_API_KEY")
-)
-
-model = ChatGoogleGenerativeAI(
-    model='gemini-2.0-flash',
-    temperature=0,
-    api_key=get_secret("GEMINI_API_KEY")
-)
+# The pandas agent and the formatting calls use the same shared client, see llm_clients
+llm = get_llm('gemini-2.0-flash', temperature=0)
+model = llm
 
 def get_df():
     """
-    Loads Dataframe
+    Loads Dataframe (cached per process, reloaded only when the workbook changes)
     """
     where_is_prog_running = where_is_it_running()
-    print(where_is_prog_running)
-    if where_is_prog_running == 'local':
-        print("Local Running...")
-        df = pd.read_excel(io='./data/excel/henkel_inventory_dummy_data.xlsx')
-        return df
-    elif where_is_prog_running == 'streamlit':
-        # Handle when deployable
-        df = pd.read_excel(io='data/excel/henkel_inventory_dummy_data.xlsx')
-        return df
-    else:
+    if where_is_prog_running not in ('local', 'streamlit'):
         raise ValueError(f"Unknown environment: {where_is_prog_running}")
+    return inventory_store.get_df()
 
-@tool
-def dataframe_scraper(query: str) -> str:
+AGENT_PREFIX = """
+You are working with a pandas dataframe in Python. The name of the dataframe is `df`.
+A prebuilt index named `idx` is also available for fast lookups, prefer it over boolean masks:
+- idx.rows(column, value) returns the rows of `df` where column equals value (case-insensitive),
+  for the columns 'Item ID', 'Item Name', 'Make', 'Model Number', 'Type', 'Item Status', 'Condition' and 'Currently At'
+- idx.group_sum(column) returns the total Quantity per value of that column, sorted descending
+You should use the tools below to answer the question posed of you:"""
+
+class PandasAgentPool:
+    """
+    Keeps built pandas dataframe agents for the current data version so that
+    the prompt, tools and REPL aren't rebuilt for every query. Each checkout gets
+    exclusive use of one executor and a fresh REPL namespace.
     """
-    Uses a language model agent to answer a query about the data.
-    This tool is intended to allow an LLM to interact with tabular data stored in an Excel file.
 
-    Parameters:
-        query (str): A natural language question or instruction about the data.
+    def __init__(self, max_idle: int = 4):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._version = None
+        self._idle = []
+        self.stats = {'created': 0, 'reused': 0, 'construction_seconds': 0.0}
 
-    Returns:
-        str: The result of the query execution by the agent, as a string.
-    """
-    try:
-        df = get_df()
-        
+    def _build(self, df: pd.DataFrame):
+        start_time = time.time()
         agent = create_pandas_dataframe_agent(
             llm=llm,
             df=df,
+            prefix=AGENT_PREFIX,
             verbose=True,
             agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
             allow_dangerous_code=True,
             max_iterations=20,
             return_intermediate_steps=False
         )
-        
-        response = agent.invoke({"input": query})
-        
-        if isinstance(response, dict):
-            output = response.get('output', str(response))
-        else:
-            output = str(response)
+        elapsed = time.time() - start_time
+        with self._lock:
+            self.stats['created'] += 1
+            self.stats['construction_seconds'] += elapsed
+        print(f"Built pandas agent in {elapsed * 1000:.1f} ms")
+        return agent
+
+    @staticmethod
+    def _reset_namespace(agent, df: pd.DataFrame):
+        # Bound to this checkout's copy-on-write frame, the shared index itself is read-only
+        index = inventory_store.get_index().bind(df)
+        for agent_tool in agent.tools:
+            if hasattr(agent_tool, 'locals'):
+                agent_tool.locals = {"df": df, "idx": index}
+                agent_tool.globals = {}
+
+    def _acquire(self):
+        """Returns (agent, data version); the agent is built if no idle one matches the data."""
+        version = inventory_store.data_version()
+        df = get_df()
+
+        agent = None
+        with self._lock:
+            if self._version != version:
+                self._version = version
+                self._idle = []
+            if self._idle:
+                agent = self._idle.pop()
+                self.stats['reused'] += 1
+
+        if agent is None:
+            agent = self._build(df)
+        self._reset_namespace(agent, df)
+        return agent, version
+
+    def _release(self, agent, version):
+        with self._lock:
+            if self._version == version and len(self._idle) < self.max_idle:
+                self._idle.append(agent)
+
+    @contextmanager
+    def checkout(self):
+        agent, version = self._acquire()
+        try:
+            yield agent
+        finally:
+            self._release(agent, version)
+
+    @asynccontextmanager
+    async def acheckout(self):
+        # A cold checkout loads the workbook and builds an agent, keep that off the event loop
+        agent, version = await asyncio.to_thread(self._acquire)
+        try:
+            yield agent
+        finally:
+            self._release(agent, version)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        average = stats['construction_seconds'] / stats['created'] if stats['created'] else 0.0
+        stats['average_construction_seconds'] = average
+        stats['saved_seconds'] = average * stats['reused']
+        return stats
 
-        return output
+agent_pool = PandasAgentPool()
+
+class AgentIterationTracer(BaseCallbackHandler):
+    """
+    Records one span per pandas agent iteration (model call + tool run), ending when
+    the agent picks its next action or finishes.
+    """
+    run_inline = True  # keep the span on the caller's trace
+
+    def __init__(self):
+        self._started_ns = time.time_ns()
+        self.iterations = 0
+
+    def _end_iteration(self, **attributes):
+        self.iterations += 1
+        record_span("pandas_agent.iteration", self._started_ns, iteration=self.iterations, **attributes)
+        self._started_ns = time.time_ns()
+
+    def on_tool_end(self, output, **kwargs):
+        self._end_iteration(outcome="tool")
+
+    def on_agent_finish(self, finish, **kwargs):
+        self._end_iteration(outcome="finish")
+
+def _invoke_agent(agent, query: str):
+    tracer = AgentIterationTracer()
+    with span("pandas_agent") as current:
+        response = agent.invoke({"input": query}, config={"callbacks": [tracer]})
+        current.set(iterations=tracer.iterations)
+    return response
+
+async def _ainvoke_agent(agent, query: str):
+    tracer = AgentIterationTracer()
+    with span("pandas_agent") as current:
+        response = await agent.ainvoke({"input": query}, config={"callbacks": [tracer]})
+        current.set(iterations=tracer.iterations)
+    return response
+
+@tool
+def dataframe_scraper(query: str) -> str:
+    """
+    Uses a language model agent to answer a query about the data.
+    This tool is intended to allow an LLM to interact with tabular data stored in an Excel file.
+
+    Parameters:
+        query (str): A natural language question or instruction about the data.
+
+    Returns:
+        str: The result of the query execution by the agent, as a string.
+    """
+    try:
+        with agent_pool.checkout() as agent:
+            response = _invoke_agent(agent, query)
+        return _agent_output(response)
     
     except Exception as e:
         error_msg = f"Error in dataframe_scraper: {str(e)}"
         print(error_msg)
         return error_msg
 
+def _agent_output(response) -> str:
+    if isinstance(response, dict):
+        return response.get('output', str(response))
+    return str(response)
+
+async def adataframe_scraper(query: str) -> str:
+    """
+    Async counterpart of the dataframe_scraper tool, same error contract.
+    """
+    try:
+        async with agent_pool.acheckout() as agent:
+            response = await _ainvoke_agent(agent, query)
+        return _agent_output(response)
+
+    except Exception as e:
+        error_msg = f"Error in dataframe_scraper: {str(e)}"
+        print(error_msg)
+        return error_msg
+
 tools = [dataframe_scraper]
 model_with_tools = model.bind_tools(tools)
 
@@ -106,50 +237,183 @@ The answer should be in the following schema:
 )
 
 
+def cache_answer(query: str, tool_result: str, parsed_response):
+    # Don't remember failures, the next attempt may well succeed
+    if not str(tool_result).startswith("Error in dataframe_scraper"):
+        answer_cache.set(query, parsed_response)
+
+def _retrieve(query: str) -> OutputSchema:
+    formatted_prompt = prompt.format(query=query, output_schema=parser.get_format_instructions())
+    with span("tool_selection"):
+        response = model_with_tools.invoke(formatted_prompt)
+
+    if hasattr(response, 'tool_calls') and response.tool_calls:
+        tool_call = response.tool_calls[0]
+        tool_result = dataframe_scraper.invoke(tool_call['args'])
+
+        follow_up_prompt = f"""
+        Based on the query: {query}
+        The tool returned: {tool_result}
+
+        Please format this according to the output schema:
+        {parser.get_format_instructions()}
+        """
+
+        with span("formatting"):
+            final_response = model.invoke(follow_up_prompt)
+            parsed_response = parser.parse(final_response.content)
+        cache_answer(query, tool_result, parsed_response)
+        return parsed_response
+    else:
+        tool_result = dataframe_scraper.invoke({"query": query})
+
+        format_prompt = f"""
+        Query: {query}
+        Tool Response: {tool_result}
+
+        Format this according to the schema:
+        {parser.get_format_instructions()}
+        """
+
+        with span("formatting"):
+            formatted_response = model.invoke(format_prompt)
+            parsed_response = parser.parse(formatted_response.content)
+        cache_answer(query, tool_result, parsed_response)
+        return parsed_response
+
 def retriever(query: str) -> dict:
-    retries, max_retries = 0, 5
-    while retries < max_retries:
-        try:
-            formatted_prompt = prompt.format(query=query, output_schema=parser.get_format_instructions())
-            response = model_with_tools.invoke(formatted_prompt)
-            
-            if hasattr(response, 'tool_calls') and response.tool_calls:
-                tool_call = response.tool_calls[0]
-                tool_result = dataframe_scraper.invoke(tool_call['args'])
-                
-                follow_up_prompt = f"""
-                Based on the query: {query}
-                The tool returned: {tool_result}
-
-                Please format this according to the output schema:
-                {parser.get_format_instructions()}
-                """
-                
-                final_response = model.invoke(follow_up_prompt)
-                
-                parsed_response = parser.parse(final_response.content)
-                return parsed_response
-            else:
-                tool_result = dataframe_scraper.invoke({"query": query})
-                
-                format_prompt = f"""
-                Query: {query}
-                Tool Response: {tool_result}
-
-                Format this according to the schema:
-                {parser.get_format_instructions()}
-                """
-                
-                formatted_response = model.invoke(format_prompt)
-                parsed_response = parser.parse(formatted_response.content)
-                return parsed_response
-        
-        except Exception as e:
-            print(f"Error in retriever (attempt {retries + 1}): {e}")
-            retries += 1
-            time.sleep(5 * retries)
-    
-    return None
+    cached_response = answer_cache.get(query)
+    if cached_response is not None:
+        print("Answer served from cache")
+        return cached_response
+
+    try:
+        return call_with_retry(_retrieve, query, policy=LLM_POLICY, name="retriever")
+    except Exception as e:
+        print(f"Error in retriever: {e}")
+        return None
+
+async def _aretrieve(query: str) -> OutputSchema:
+    formatted_prompt = prompt.format(query=query, output_schema=parser.get_format_instructions())
+    with span("tool_selection"):
+        response = await model_with_tools.ainvoke(formatted_prompt)
+
+    if hasattr(response, 'tool_calls') and response.tool_calls:
+        tool_query = response.tool_calls[0]['args'].get('query', query)
+    else:
+        tool_query = query
+    tool_result = await adataframe_scraper(tool_query)
+
+    format_prompt = f"""
+    Based on the query: {query}
+    The tool returned: {tool_result}
+
+    Please format this according to the output schema:
+    {parser.get_format_instructions()}
+    """
+
+    with span("formatting"):
+        final_response = await model.ainvoke(format_prompt)
+        parsed_response = parser.parse(final_response.content)
+    cache_answer(query, tool_result, parsed_response)
+    return parsed_response
+
+async def aretriever(query: str) -> OutputSchema:
+    cached_response = answer_cache.get(query)
+    if cached_response is not None:
+        print("Answer served from cache")
+        return cached_response
+
+    try:
+        return await acall_with_retry(_aretrieve, query, policy=LLM_POLICY, name="aretriever")
+    except Exception as e:
+        print(f"Error in aretriever: {e}")
+        return None
+
+paraphrase_prompt = PromptTemplate(
+    template="""
+You are an expert Data Analyst for inventory management.
+
+Query: {query}
+Tool Response: {tool_result}
+
+Answer the query in plain, human-understandable language using the tool response.
+Include every value from the response and simplify it if there is any error.
+The answer should be direct and there should not be any filler text from your side.
+""",
+    input_variables=['query', 'tool_result']
+)
+
+def select_tool_query(query: str) -> str:
+    """
+    Asks the model for the dataframe_scraper call, falls back to the query itself if it doesn't make one.
+    """
+    with span("tool_selection"):
+        response = model_with_tools.invoke(prompt.format(query=query))
+    if hasattr(response, 'tool_calls') and response.tool_calls:
+        return response.tool_calls[0]['args'].get('query', query)
+    return query
+
+def stream_paraphrase(query: str, tool_result: str):
+    """
+    Streams the human-readable answer for the tool result token by token.
+    If the model fails before producing anything, the raw tool result is yielded instead.
+    """
+    streamed = False
+    # Spans can't wrap a generator (it is resumed from the consumer's context), time it by hand
+    start_ns = time.time_ns()
+    first_token_ms = None
+    try:
+        for chunk in model.stream(paraphrase_prompt.format(query=query, tool_result=tool_result)):
+            if chunk.content:
+                if not streamed:
+                    first_token_ms = (time.time_ns() - start_ns) / 1e6
+                streamed = True
+                yield chunk.content
+    except Exception as e:
+        print(f"Error in stream_paraphrase: {e}")
+        if not streamed:
+            yield str(tool_result)
+    finally:
+        record_span("formatting", start_ns, streamed=True, first_token_ms=first_token_ms)
+
+def format_tool_result(query: str, tool_result: str) -> OutputSchema:
+    """
+    Builds the OutputSchema locally from the tool result, without another model call.
+    The pandas agent's final answer is already a plain-language sentence.
+    """
+    tool_result = str(tool_result).strip()
+    if tool_result.startswith("Error in dataframe_scraper"):
+        paraphrased_output = "I couldn't get that from the inventory data. Please try rephrasing your question."
+    else:
+        paraphrased_output = tool_result
+    return OutputSchema(query=query, response=tool_result, paraphrased_output=paraphrased_output)
+
+def lean_retriever(query: str) -> OutputSchema:
+    """
+    Lean pipeline counterpart of retriever: the query is already prepared for the tool,
+    so the tool is called directly and its result formatted locally.
+    """
+    cached_response = answer_cache.get(query)
+    if cached_response is not None:
+        print("Answer served from cache")
+        return cached_response
+
+    tool_result = dataframe_scraper.invoke({"query": query})
+    parsed_response = format_tool_result(query, tool_result)
+    cache_answer(query, tool_result, parsed_response)
+    return parsed_response
+
+async def alean_retriever(query: str) -> OutputSchema:
+    cached_response = answer_cache.get(query)
+    if cached_response is not None:
+        print("Answer served from cache")
+        return cached_response
+
+    tool_result = await adataframe_scraper(query)
+    parsed_response = format_tool_result(query, tool_result)
+    cache_answer(query, tool_result, parsed_response)
+    return parsed_response
 
 if __name__ == '__main__':
     response = retriever(query="What is the total number of rows in the data? List down the names of all the columns")
@@ -161,4 +425,9 @@ if __name__ == '__main__':
         else:
             print(f"Response: {response}")
     else:
-        print("Failed to get response after all retries")
\ No newline at end of file
+        print("Failed to get response after all retries")
+
+    stats = agent_pool.get_stats()
+    print(f"Pandas agents built: {stats['created']}, reused: {stats['reused']}, "
+          f"avg construction: {stats['average_construction_seconds'] * 1000:.1f} ms, "
+          f"construction time saved: {stats['saved_seconds'] * 1000:.1f} ms")
\ No newline at end of file
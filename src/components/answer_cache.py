@@ -0,0 +1,114 @@
+import re
+from cache import LRUCache
+from config import get_secret
+from inventory import inventory_store, normalize_text
+
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'at', 'for', 'to', 'is', 'are', 'was', 'were', 'be',
+    'do', 'does', 'we', 'us', 'our', 'you', 'me', 'my', 'i', 'please', 'can', 'could', 'tell',
+    'what', 'which', 'show', 'give', 'list', 'there', 'any', 'currently', 'current', 'present'
+}
+# Words a rephrasing adds or drops without changing the answer; a similar cached question
+# is only reused when every word the two don't share is one of these
+PARAPHRASE_WORDS = {
+    'all', 'every', 'kindly', 'now', 'right', 'here', 'just', 'item', 'items', 'thing', 'things',
+    'stuff', 'product', 'products', 'have', 'has', 'got', 'get', 'find', 'see', 'know', 'want', 'would',
+    'like', 'let', 'located', 'kept', 'stored', 'placed', 'lying', 'stock', 'inventory', 'that', 'with',
+    'whose', 'being', 'also', 'exactly'
+}
+NUMBER_PATTERN = re.compile(r'\d')
+# "don't" normalizes to "don t"
+NEGATIONS = {'not', 'no', 'non', 'never', 'without', 'except', 't'}
+# Values of these columns filter the answer ("Loctite", "damaged", "QC Lab", "adhesive")
+QUALIFIER_COLUMNS = ('Item ID', 'Item Name', 'Make', 'Model Number', 'Condition', 'Item Status', 'Currently At', 'Type')
+
+
+def intent_tokens(text: str) -> frozenset:
+    return frozenset(token for token in normalize_text(text).split() if token not in STOPWORDS)
+
+
+def token_set_similarity(first: frozenset, second: frozenset) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def exact_terms(tokens: frozenset) -> frozenset:
+    """
+    Tokens that change the answer however similar the rest of the question is: numbers
+    (item codes, "top 5"), negations and category values such as a condition or a location.
+    """
+    terms = {token for token in tokens if NUMBER_PATTERN.search(token) or token in NEGATIONS}
+    labels = inventory_store.get_index().labels
+    for column in QUALIFIER_COLUMNS:
+        for phrase in labels.get(column, {}):
+            if set(phrase.split()) <= tokens:
+                terms.add(phrase)
+    return frozenset(terms)
+
+
+def is_paraphrase(first: frozenset, second: frozenset) -> bool:
+    """True if the intents only differ by PARAPHRASE_WORDS."""
+    return (first ^ second) <= PARAPHRASE_WORDS
+
+
+class AnswerCache:
+    """
+    Caches retriever answers keyed on the normalized intent and the inventory data version.
+
+    Lookups try the exact normalized intent first, then the most similar cached intent
+    by token-set (Jaccard) similarity. A similar intent is only reused when the words the
+    two don't share are PARAPHRASE_WORDS, and numbers, negations and column values (see
+    exact_terms) must match exactly, so "Loctite" never answers for "Technomelt", "goggles"
+    never for "gloves" and "damaged items" never for "items that are not damaged".
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 900, similarity_threshold: float = 0.8):
+        self.similarity_threshold = similarity_threshold
+        self._cache = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._version = None
+
+    def _current_version(self) -> str:
+        version = inventory_store.data_version()
+        if version != self._version:
+            # Answers computed against an older workbook are no longer valid
+            self._cache.clear()
+            self._version = version
+        return version
+
+    def get(self, intent: str):
+        version = self._current_version()
+        tokens = intent_tokens(intent)
+        if not tokens:
+            return None
+
+        exact = self._cache.get((version, tokens))
+        if exact is not None or self.similarity_threshold is None:
+            return exact
+
+        terms = exact_terms(tokens)
+        best_score, best_answer = 0.0, None
+        for (entry_version, entry_tokens), answer in self._cache.items():
+            if entry_version != version or not is_paraphrase(tokens, entry_tokens):
+                continue
+            if exact_terms(entry_tokens) != terms:
+                continue
+            score = token_set_similarity(tokens, entry_tokens)
+            if score > best_score:
+                best_score, best_answer = score, answer
+        return best_answer if best_score >= self.similarity_threshold else None
+
+    def set(self, intent: str, answer):
+        tokens = intent_tokens(intent)
+        if tokens:
+            self._cache.set((self._current_version(), tokens), answer)
+
+    def clear(self):
+        self._cache.clear()
+
+
+answer_cache = AnswerCache(
+    max_entries=int(get_secret("ANSWER_CACHE_MAX_ENTRIES", 512)),
+    ttl_seconds=float(get_secret("ANSWER_CACHE_TTL_SECONDS", 900)),
+    similarity_threshold=float(get_secret("ANSWER_CACHE_SIMILARITY", 0.8))
+)
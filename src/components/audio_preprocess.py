@@ -0,0 +1,132 @@
+import io
+import hashlib
+from collections import namedtuple
+from config import get_secret
+from telemetry import span
+
+try:
+    from pydub import AudioSegment
+    from pydub.silence import detect_leading_silence
+    PYDUB_AVAILABLE = True
+except ImportError:
+    PYDUB_AVAILABLE = False
+
+# Speech recognizers work at 16 kHz mono, anything above is upload and decode cost for nothing
+TARGET_SAMPLE_RATE = 16000
+TARGET_SAMPLE_WIDTH = 2  # 16-bit PCM
+# Silence is anything this many dB below the recording's average loudness
+SILENCE_OFFSET_DB = 16
+# Kept around the speech so the first and last words aren't clipped
+SILENCE_PADDING_MS = 150
+
+# wav needs no encoder; flac and opus are smaller but need ffmpeg (packages.txt)
+EXPORT_FORMATS = {
+    "wav": {"format": "wav"},
+    "flac": {"format": "flac"},
+    "opus": {"format": "ogg", "codec": "libopus", "bitrate": "24k"},
+}
+# Format uploaded to AssemblyAI: flac is lossless and about half the size of WAV, opus is far smaller
+UPLOAD_FORMAT = get_secret("STT_UPLOAD_FORMAT", "flac")
+
+# digest: sha256 of the normalized PCM, identical speech hashes the same whatever container it came in
+PreparedAudio = namedtuple('PreparedAudio', ['data', 'format', 'seconds', 'original_bytes', 'digest'])
+# The decoded, normalized recording before encoding; segment is None if it couldn't be decoded
+NormalizedAudio = namedtuple('NormalizedAudio', ['segment', 'raw', 'seconds', 'digest'])
+
+
+def _read_bytes(audio) -> bytes:
+    if isinstance(audio, (bytes, bytearray)):
+        return bytes(audio)
+    if hasattr(audio, 'read'):
+        if hasattr(audio, 'seek'):
+            audio.seek(0)
+        return audio.read()
+    with open(audio, 'rb') as f:
+        return f.read()
+
+
+def _source_format(raw: bytes) -> str:
+    """'wav' for RIFF/WAVE data, which pydub decodes itself; other formats need ffmpeg to probe them."""
+    return "wav" if raw[:4] == b"RIFF" and raw[8:12] == b"WAVE" else None
+
+
+def trim_silence(segment, offset_db: float = SILENCE_OFFSET_DB, padding_ms: int = SILENCE_PADDING_MS):
+    """Cuts leading and trailing silence, relative to the recording's own loudness."""
+    if segment.dBFS == float('-inf'):
+        return segment  # digital silence, nothing to anchor the threshold to
+    threshold = segment.dBFS - offset_db
+    start = detect_leading_silence(segment, silence_threshold=threshold)
+    end = len(segment) - detect_leading_silence(segment.reverse(), silence_threshold=threshold)
+    if start >= end:
+        return segment
+    return segment[max(0, start - padding_ms):min(len(segment), end + padding_ms)]
+
+
+def normalize_audio(audio) -> NormalizedAudio:
+    """
+    Downmixes to mono, resamples to 16 kHz 16-bit and trims silence, without encoding the result,
+    so the digest can be looked up before paying for an encode. Takes a path, a binary file object or bytes.
+    """
+    raw = _read_bytes(audio)
+    if not PYDUB_AVAILABLE:
+        return NormalizedAudio(None, raw, None, hashlib.sha256(raw).hexdigest())
+
+    with span("preprocess", original_bytes=len(raw)) as current:
+        segment = AudioSegment.from_file(io.BytesIO(raw), format=_source_format(raw))
+        original_seconds = len(segment) / 1000
+        segment = segment.set_channels(1).set_frame_rate(TARGET_SAMPLE_RATE).set_sample_width(TARGET_SAMPLE_WIDTH)
+        segment = trim_silence(segment)
+        current.set(original_seconds=original_seconds, audio_seconds=len(segment) / 1000)
+    return NormalizedAudio(segment, raw, len(segment) / 1000, hashlib.sha256(segment.raw_data).hexdigest())
+
+
+def normalize_for_stt(audio) -> NormalizedAudio:
+    """normalize_audio, falling back to the original audio on decode errors."""
+    try:
+        return normalize_audio(audio)
+    except Exception as e:
+        print(f"Audio preprocessing failed, using the original audio: {e}")
+        raw = _read_bytes(audio)
+        return NormalizedAudio(None, raw, None, hashlib.sha256(raw).hexdigest())
+
+
+def encode_audio(normalized: NormalizedAudio, export_format: str = "wav") -> PreparedAudio:
+    """Encodes a normalized recording; audio that couldn't be decoded is passed through unchanged."""
+    if normalized.segment is None:
+        return PreparedAudio(normalized.raw, None, None, len(normalized.raw), normalized.digest)
+
+    with span("encode") as current:
+        output = io.BytesIO()
+        try:
+            normalized.segment.export(output, **EXPORT_FORMATS[export_format])
+        except Exception as e:
+            # No ffmpeg for the compressed formats, plain WAV is always possible
+            print(f"Could not encode audio as {export_format}, sending WAV: {e}")
+            export_format = "wav"
+            output = io.BytesIO()
+            normalized.segment.export(output, **EXPORT_FORMATS[export_format])
+        current.set(format=export_format, output_bytes=output.tell())
+    return PreparedAudio(output.getvalue(), export_format, normalized.seconds, len(normalized.raw), normalized.digest)
+
+
+def preprocess_audio(audio, export_format: str = "wav") -> PreparedAudio:
+    """
+    Downmixes to mono, resamples to 16 kHz 16-bit, trims silence and encodes the result.
+    Takes a path, a binary file object or bytes. Without pydub the audio is passed through unchanged.
+    """
+    return encode_audio(normalize_audio(audio), export_format)
+
+
+def prepare_for_stt(audio, export_format: str = "wav") -> PreparedAudio:
+    """preprocess_audio, falling back to the original audio on decode errors."""
+    return encode_audio(normalize_for_stt(audio), export_format)
+
+
+if __name__ == '__main__':
+    import sys
+
+    audio_file_path = sys.argv[1] if len(sys.argv) > 1 else './data/audios/harvard.wav'
+    for name in EXPORT_FORMATS:
+        prepared = preprocess_audio(audio_file_path, name)
+        print(f"[{name}] {prepared.original_bytes} -> {len(prepared.data)} bytes "
+              f"({len(prepared.data) / prepared.original_bytes:.0%}), {prepared.seconds}s of audio as {prepared.format}")
@@ -0,0 +1,175 @@
+import re
+from inventory import inventory_store, normalize_text, InventoryIndex
+from agent import OutputSchema
+
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10
+}
+DEFAULT_TOP_N = 5
+
+TOP_PATTERN = re.compile(r'\btop (\d+|' + '|'.join(NUMBER_WORDS) + r')?\b')
+MODEL_PATTERN = re.compile(r'\bmodel (number|no|num)\b')
+LOCATION_PATTERN = re.compile(r'\b(where|located|location|kept|stored|placed)\b')
+COUNT_PATTERN = re.compile(r'\b(how many|count|quantity|qty|stock|available|units)\b')
+
+# Questions asking for several things at once are left to the LLM agent
+COMPOUND_PATTERN = re.compile(r'\b(and|also|if yes|or)\b')
+MAX_WORDS = 20
+
+# The fast path only answers when every word of the question is accounted for: the item,
+# the location, N, and the words below. Anything else ("damaged", "not", "of type adhesive",
+# an unknown location) may change the answer, so the question goes to the LLM instead.
+FILLER_WORDS = {
+    'what', 'whats', 's', 'is', 'are', 'the', 'a', 'an', 'of', 'in', 'at', 'do', 'does', 'we',
+    'have', 'there', 'our', 'please', 'tell', 'me', 'show', 'list', 'give', 'currently', 'inventory',
+}
+INTENT_WORDS = {
+    'top_products': {'top', 'products', 'product', 'items', 'item', 'by', 'with', 'quantity', 'qty', 'present'},
+    'model_number': {'model', 'number', 'no', 'num'},
+    'location': {'where', 'located', 'location', 'kept', 'stored', 'placed', 'can', 'i', 'find', 'it'},
+    'count': {'how', 'many', 'much', 'total', 'count', 'quantity', 'qty', 'stock', 'available', 'units'},
+}
+
+
+def _find_longest(words: list, vocabulary: dict):
+    """
+    Finds the longest vocabulary entry mentioned in the words, as a whole phrase.
+    Returns (value, positions of its words) or (None, empty set).
+    """
+    for length in range(len(words), 0, -1):
+        for start in range(len(words) - length + 1):
+            phrase = ' '.join(words[start:start + length])
+            if phrase in vocabulary:
+                return vocabulary[phrase], set(range(start, start + length))
+    return None, set()
+
+
+def _fully_matched(words: list, intent: str, consumed: set) -> bool:
+    """True if every word outside the matched item/location/N is filler or a keyword of the intent."""
+    allowed = FILLER_WORDS | INTENT_WORDS[intent]
+    return all(word in allowed for position, word in enumerate(words) if position not in consumed)
+
+
+def _format_quantity(value) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.2f}"
+
+
+def answer_count(index: InventoryIndex, item_name: str) -> str:
+    positions = index.positions_for('Item Name', item_name)
+    total = index.quantity[positions].sum()
+    return (f"There are a total of {_format_quantity(total)} units of {item_name} "
+            f"in the inventory across {len(positions)} entries.")
+
+
+def answer_location(index: InventoryIndex, item_name: str) -> str:
+    per_location = index.group_sum('Currently At', index.positions_for('Item Name', item_name))
+    places = ", ".join(f"{place} ({_format_quantity(qty)} units)" for place, qty in per_location.items())
+    return f"{item_name} is located at: {places}."
+
+
+def answer_model_number(index: InventoryIndex, item_name: str) -> str:
+    models = [str(model) for model in index.rows('Item Name', item_name)['Model Number'].dropna().unique()]
+    if not models:
+        return f"No model number is recorded for {item_name}."
+    if len(models) == 1:
+        return f"The model number of {item_name} is {models[0]}."
+    return f"{item_name} is listed under the model numbers: {', '.join(models)}."
+
+
+def answer_top_products(index: InventoryIndex, top_n: int, location: str = None) -> str:
+    positions = None if location is None else index.positions_for('Currently At', location)
+    totals = index.group_sum('Item Name', positions).head(top_n)
+    where = f" in {location}" if location else ""
+    ranked = ", ".join(f"{rank}. {name} ({_format_quantity(qty)} units)"
+                       for rank, (name, qty) in enumerate(totals.items(), start=1))
+    return f"The top {len(totals)} products{where} by quantity are: {ranked}."
+
+
+def match_intent(user_text: str):
+    """
+    Matches the user text against the supported question shapes.
+    Returns (intent, arguments) or None when the question should go to the LLM.
+    """
+    normalized = normalize_text(user_text)
+    if not normalized or len(normalized.split()) > MAX_WORDS or COMPOUND_PATTERN.search(normalized):
+        return None
+
+    index = inventory_store.get_index()
+    item_names, locations = index.labels['Item Name'], index.labels['Currently At']
+    words = normalized.split()
+
+    top_match = TOP_PATTERN.search(normalized)
+    if top_match:
+        amount = top_match.group(1)
+        if amount is None:
+            top_n = DEFAULT_TOP_N
+        else:
+            top_n = int(amount) if amount.isdigit() else NUMBER_WORDS[amount]
+        if top_n < 1:
+            return None
+        # TOP_PATTERN matches whole words, so its span maps back onto word positions
+        first = len(normalized[:top_match.start()].split())
+        consumed = set(range(first, first + len(top_match.group(0).split())))
+        location, location_words = _find_longest(words, locations)
+        if not _fully_matched(words, 'top_products', consumed | location_words):
+            return None
+        return 'top_products', {'top_n': top_n, 'location': location}
+
+    item_name, item_words = _find_longest(words, item_names)
+    if item_name is None:
+        return None
+
+    if MODEL_PATTERN.search(normalized):
+        intent = 'model_number'
+    elif LOCATION_PATTERN.search(normalized):
+        intent = 'location'
+    elif COUNT_PATTERN.search(normalized):
+        intent = 'count'
+    else:
+        return None
+    # Filters such as a location or a condition aren't supported for single items
+    if not _fully_matched(words, intent, item_words):
+        return None
+    return intent, {'item_name': item_name}
+
+
+INTENT_HANDLERS = {
+    'count': answer_count,
+    'location': answer_location,
+    'model_number': answer_model_number,
+    'top_products': answer_top_products,
+}
+
+
+def answer_fast_path(user_text: str):
+    """
+    Answers common inventory questions directly from the inventory index without any LLM call.
+    Returns an OutputSchema, or None if the question isn't recognised.
+    """
+    try:
+        match = match_intent(user_text)
+        if match is None:
+            return None
+
+        intent, arguments = match
+        answer = INTENT_HANDLERS[intent](inventory_store.get_index(), **arguments)
+        return OutputSchema(query=user_text, response=answer, paraphrased_output=answer)
+
+    except Exception as e:
+        # Never block the LLM path because of the fast path
+        print(f"Error in fast path: {e}")
+        return None
+
+
+if __name__ == '__main__':
+    sample_queries = [
+        "What is the total count of Bonderite 6278?",
+        "What are the top 5 products present in the R&D dept. with quantity?",
+        "What is the model number of Bonderite 6278?",
+        "Where is Bonderite 6278 located?",
+        "Do we have any adhesives available for rubber tyres? If yes, where is it kept in the inventory?",
+    ]
+    for sample_query in sample_queries:
+        response = answer_fast_path(sample_query)
+        print(f"{sample_query}\n  -> {response.paraphrased_output if response else 'LLM path'}")
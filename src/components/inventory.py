@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import copy
+import threading
+from types import MappingProxyType
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+INVENTORY_PATH = 'data/excel/henkel_inventory_dummy_data.xlsx'
+SNAPSHOT_DIR = 'data/cache'
+
+# With copy-on-write, shallow copies handed to sessions share the loaded
+# buffers and any mutation inside a session only copies the touched column.
+pd.set_option('mode.copy_on_write', True)
+
+KEY_COLUMNS = ('Item ID', 'Item Name', 'Make', 'Model Number')
+CATEGORY_COLUMNS = ('Type', 'Item Status', 'Condition', 'Currently At')
+
+
+def normalize_text(text) -> str:
+    """Lower-cases and strips punctuation so lookups ignore case, spacing and 'department' vs 'dept.'."""
+    text = str(text).lower()
+    text = re.sub(r'\bdepartment\b', 'dept', text)
+    text = re.sub(r'[^a-z0-9&]+', ' ', text)
+    return ' '.join(text.split())
+
+
+class InventoryIndex:
+    """
+    Lookup structures built once per loaded inventory.
+
+    - positions: normalized value -> row positions, for the key and category columns
+    - labels: normalized value -> original value, for matching names in free text
+    - categoricals: integer codes per column, used for group-bys without hashing strings
+
+    The index is shared by every session, so its mappings and arrays are read-only;
+    use bind() to pair it with a session's own copy of the frame.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.positions = {}
+        self.labels = {}
+        self.categoricals = {}
+
+        for column in KEY_COLUMNS + CATEGORY_COLUMNS:
+            if column not in df.columns:
+                continue
+            values = df[column]
+            normalized = values.map(normalize_text, na_action='ignore')
+            positions = normalized.groupby(normalized, sort=False).indices
+            for array in positions.values():
+                array.flags.writeable = False
+            self.positions[column] = MappingProxyType(positions)
+            self.labels[column] = MappingProxyType(dict(zip(normalized.dropna(), values.dropna())))
+            self.categoricals[column] = pd.Categorical(values)
+        self.positions = MappingProxyType(self.positions)
+        self.labels = MappingProxyType(self.labels)
+        self.categoricals = MappingProxyType(self.categoricals)
+
+        if 'Quantity' in df.columns:
+            self.quantity = pd.to_numeric(df['Quantity'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        else:
+            self.quantity = np.zeros(len(df))
+        self.quantity.flags.writeable = False
+
+    def bind(self, df: pd.DataFrame) -> 'InventoryIndex':
+        """A copy of the index whose `df` (and rows()) is the given session frame, the lookups are shared."""
+        bound = copy.copy(self)
+        bound.df = df
+        return bound
+
+    def positions_for(self, column: str, value) -> np.ndarray:
+        return self.positions[column].get(normalize_text(value), np.empty(0, dtype=np.intp))
+
+    def rows(self, column: str, value) -> pd.DataFrame:
+        """Rows whose `column` equals `value` (case/punctuation-insensitive)."""
+        return self.df.iloc[self.positions_for(column, value)]
+
+    def group_sum(self, column: str, positions: np.ndarray = None) -> pd.Series:
+        """Total Quantity per value of `column`, optionally restricted to the given row positions."""
+        categorical = self.categoricals[column]
+        codes = categorical.codes
+        weights = self.quantity
+        if positions is not None:
+            codes = codes[positions]
+            weights = weights[positions]
+        present = codes >= 0
+        totals = np.bincount(codes[present], weights=weights[present], minlength=len(categorical.categories))
+        totals = pd.Series(totals, index=categorical.categories, name='Quantity')
+        counts = np.bincount(codes[present], minlength=len(categorical.categories))
+        return totals[counts > 0].sort_values(ascending=False)
+
+
+LoadedInventory = namedtuple('LoadedInventory', ['df', 'index', 'signature', 'version'])
+
+
+class InventoryStore:
+    """
+    Process-wide, thread-safe cache of the inventory workbook.
+    The workbook is parsed once and reloaded only when its mtime/size changes.
+
+    When pyarrow is available the parsed workbook is also written to an
+    uncompressed Feather (Arrow IPC) snapshot which is memory-mapped on load,
+    so restarts skip the XLSX parse and worker processes share the same pages.
+    """
+
+    def __init__(self, path: str = INVENTORY_PATH, snapshot_dir: str = SNAPSHOT_DIR, use_snapshot: bool = True):
+        self.path = path
+        self.use_snapshot = use_snapshot and ARROW_AVAILABLE
+        base_name = os.path.splitext(os.path.basename(path))[0]
+        self.snapshot_path = os.path.join(snapshot_dir, f"{base_name}.feather")
+        self.snapshot_meta_path = os.path.join(snapshot_dir, f"{base_name}.meta.json")
+        self._lock = threading.Lock()
+        self._state = None
+        self.version = 0
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, signature) -> pd.DataFrame:
+        if not self.use_snapshot:
+            return pd.read_excel(io=self.path)
+
+        if not os.path.exists(self.snapshot_path) or self._snapshot_signature() != list(signature):
+            print(f"Converting {self.path} to snapshot {self.snapshot_path}...")
+            df = self._snapshot_frame(pd.read_excel(io=self.path))
+            try:
+                self._write_snapshot(df, signature)
+            except OSError as e:
+                # e.g. read-only filesystem on the deployment, serve the frame already parsed
+                print(f"Could not write inventory snapshot: {e}")
+                return df
+
+        return self._read_snapshot()
+
+    def _snapshot_signature(self):
+        try:
+            with open(self.snapshot_meta_path) as f:
+                return json.load(f).get('source_signature')
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _snapshot_frame(df: pd.DataFrame) -> pd.DataFrame:
+        # Mixed-type object columns (e.g. free text with stray numbers) can't be
+        # stored as a single Arrow type, so store them as strings; Arrow-backed, as
+        # a snapshot load returns them, so the frame is typed the same either way
+        df = df.copy()
+        for column in df.columns:
+            if df[column].dtype == object:
+                df[column] = df[column].astype(pd.StringDtype('pyarrow'))
+        return df
+
+    def _write_snapshot(self, df: pd.DataFrame, signature):
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+
+        temp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        feather.write_feather(df, temp_path, compression='uncompressed')
+        os.replace(temp_path, self.snapshot_path)
+
+        temp_meta_path = f"{self.snapshot_meta_path}.{os.getpid()}.tmp"
+        with open(temp_meta_path, 'w') as f:
+            json.dump({'source': self.path, 'source_signature': list(signature)}, f)
+        os.replace(temp_meta_path, self.snapshot_meta_path)
+
+    def _read_snapshot(self) -> pd.DataFrame:
+        # Uncompressed Arrow buffers are used in place from the mapped file;
+        # strings stay Arrow-backed instead of being copied into Python objects
+        table = feather.read_table(self.snapshot_path, memory_map=True)
+        string_types = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+        return table.to_pandas(types_mapper=string_types.get, split_blocks=True)
+
+    def _refresh(self) -> LoadedInventory:
+        signature = self._file_signature()
+        state = self._state
+        if state is not None and state.signature == signature:
+            return state
+        with self._lock:
+            # Another thread may have reloaded while we waited on the lock
+            signature = self._file_signature()
+            state = self._state
+            if state is not None and state.signature == signature:
+                return state
+            print(f"Loading inventory from {self.path}...")
+            df = self._load(signature)
+            self.version += 1
+            self._state = LoadedInventory(df, InventoryIndex(df), signature, self.version)
+            return self._state
+
+    def get_df(self) -> pd.DataFrame:
+        """
+        Returns a read-only view of the inventory, reloading it if the file changed.
+        """
+        return self._refresh().df.copy(deep=False)
+
+    def get_index(self) -> InventoryIndex:
+        """
+        Returns the lookup index of the currently loaded inventory.
+        """
+        return self._refresh().index
+
+    def data_version(self) -> str:
+        """
+        Identifier of the currently loaded data, changes whenever the workbook does.
+        """
+        state = self._refresh()
+        mtime_ns, size = state.signature
+        return f"{state.version}-{mtime_ns}-{size}"
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+
+inventory_store = InventoryStore()
+
+
+if __name__ == '__main__':
+    import time
+
+    for attempt in range(3):
+        start_time = time.time()
+        df = inventory_store.get_df()
+        print(f"Load {attempt + 1}: {df.shape} in {(time.time() - start_time) * 1000:.2f} ms")
+    print(f"Data version: {inventory_store.data_version()}")
+
+    index = inventory_store.get_index()
+    start_time = time.time()
+    rows = index.rows('Item Name', 'Bonderite 6278')
+    print(f"Index lookup: {len(rows)} rows in {(time.time() - start_time) * 1000:.3f} ms")
+    print(index.group_sum('Currently At').head())
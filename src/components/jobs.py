@@ -0,0 +1,148 @@
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import get_secret
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    One unit of background work. The worker reports progress and streamed output through it,
+    the UI reads a snapshot whenever it polls. Cancellation is cooperative: the worker stops at
+    its next check_cancelled / set_progress / append call, a model call already in flight finishes first.
+    Spoken answers are published chunk by chunk (add_audio) so the UI can start playing before the end.
+    """
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.progress = "Queued..."
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._chunks = []
+        self._audio = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def set_progress(self, text: str):
+        self.check_cancelled()
+        with self._lock:
+            self.progress = text
+
+    def append(self, chunk: str):
+        self.check_cancelled()
+        with self._lock:
+            self._chunks.append(chunk)
+
+    def add_audio(self, audio: bytes, seconds: float):
+        self.check_cancelled()
+        with self._lock:
+            self._audio.append({'bytes': audio, 'seconds': seconds})
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'progress': self.progress,
+                'text': "".join(self._chunks),
+                'audio': list(self._audio),
+                'result': self.result,
+                'error': self.error,
+                'elapsed': (self.finished_at or time.time()) - self.created_at,
+            }
+
+
+class JobQueue:
+    """
+    A process-wide worker pool for long-running requests, addressed by job ID so any
+    Streamlit rerun (or session) can look a job up, poll it or cancel it.
+    Finished jobs are forgotten after retention_seconds.
+    """
+
+    def __init__(self, max_workers: int = 4, retention_seconds: float = 600):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn, *args, **kwargs) -> str:
+        """Runs fn(job, *args, **kwargs) on the pool; its return value becomes job.result."""
+        job = Job(kind)
+        with self._lock:
+            self._evict()
+            self._jobs[job.id] = job
+        # The worker sees the caller's context variables (telemetry session, request tags)
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job._cancel.is_set():
+            job.status, job.finished_at = "cancelled", time.time()
+            return
+        job.status = "running"
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _evict(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.retention_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> dict:
+        """Snapshot of the job for the UI, None for unknown or expired IDs."""
+        job = self.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job._cancel.set()
+        job.progress = "Cancelling..."
+        return True
+
+    def forget(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+
+job_queue = JobQueue(
+    max_workers=int(get_secret("JOB_WORKERS", 4)),
+    retention_seconds=float(get_secret("JOB_RETENTION_SECONDS", 600))
+)
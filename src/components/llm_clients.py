@@ -0,0 +1,240 @@
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_google_genai import ChatGoogleGenerativeAI
+from config import get_secret
+from retry import remaining_budget
+
+DEFAULT_MAX_CONCURRENCY = int(get_secret("LLM_MAX_CONCURRENCY", 8))
+# Per-call timeout; inside a request_deadline a call never gets more than the time left
+LLM_TIMEOUT_SECONDS = float(get_secret("LLM_TIMEOUT_SECONDS", 30))
+# Async waiters poll for a free slot with this backoff
+ASYNC_POLL_MIN_SECONDS = 0.005
+ASYNC_POLL_MAX_SECONDS = 0.1
+
+
+def _setting_name(model_name: str) -> str:
+    return "LLM_MAX_CONCURRENCY_" + "".join(c if c.isalnum() else "_" for c in model_name.upper())
+
+
+class ModelLimiter:
+    """
+    Caps the calls in flight to one model across the whole process (threads and event loops)
+    and keeps the counters behind get_pool_stats().
+    """
+
+    def __init__(self, model_name: str, max_concurrency: int):
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'errors': 0, 'rate_limited': 0, 'in_flight': 0, 'peak_in_flight': 0,
+                      'queued': 0, 'wait_seconds': 0.0, 'call_seconds': 0.0}
+
+    def _entered(self, waited: float):
+        with self._lock:
+            self.stats['queued'] -= 1
+            self.stats['calls'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+            self.stats['wait_seconds'] += waited
+
+    def acquire(self):
+        with self._lock:
+            self.stats['queued'] += 1
+        start_time = time.perf_counter()
+        self._semaphore.acquire()
+        self._entered(time.perf_counter() - start_time)
+        return time.perf_counter()
+
+    async def aacquire(self):
+        with self._lock:
+            self.stats['queued'] += 1
+        start_time = time.perf_counter()
+        # Polls instead of blocking an executor thread per waiter, which would starve
+        # asyncio.to_thread for everything else; a cancelled waiter holds nothing
+        delay = ASYNC_POLL_MIN_SECONDS
+        try:
+            while not self._semaphore.acquire(blocking=False):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, ASYNC_POLL_MAX_SECONDS)
+        except asyncio.CancelledError:
+            with self._lock:
+                self.stats['queued'] -= 1
+            raise
+        self._entered(time.perf_counter() - start_time)
+        return time.perf_counter()
+
+    def release(self, started: float, error: Exception = None):
+        self._semaphore.release()
+        with self._lock:
+            self.stats['in_flight'] -= 1
+            self.stats['call_seconds'] += time.perf_counter() - started
+            if error is not None:
+                self.stats['errors'] += 1
+                if type(error).__name__ == 'ResourceExhausted' or '429' in str(error):
+                    self.stats['rate_limited'] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats, max_concurrency=self.max_concurrency)
+        stats['average_wait_seconds'] = stats['wait_seconds'] / stats['calls'] if stats['calls'] else 0.0
+        stats['average_call_seconds'] = stats['call_seconds'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
+
+
+class TokenMeter:
+    """Gemini calls and tokens made while the meter is active, as reported by the API."""
+
+    def __init__(self):
+        self.calls = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage: dict):
+        with self._lock:
+            self.calls += 1
+            self.tokens += (usage or {}).get('total_tokens', 0)
+
+    def used(self, estimate: float) -> float:
+        """Tokens used, or the estimate if calls were made but the client reported no usage."""
+        return self.tokens if self.tokens or not self.calls else estimate
+
+
+_token_meter = contextvars.ContextVar('llm_token_meter', default=None)
+
+
+@contextmanager
+def meter_tokens(meter: TokenMeter = None):
+    """Adds the usage of every Gemini call made inside the block (including agent calls) to a TokenMeter."""
+    meter = meter or TokenMeter()
+    token = _token_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _token_meter.reset(token)
+
+
+def _meter(message):
+    meter = _token_meter.get()
+    if meter is not None:
+        meter.add(getattr(message, 'usage_metadata', None))
+
+
+def _meter_result(result):
+    for generation in result.generations:
+        _meter(generation.message)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model_name: str) -> ModelLimiter:
+    with _limiters_lock:
+        if model_name not in _limiters:
+            max_concurrency = int(get_secret(_setting_name(model_name), DEFAULT_MAX_CONCURRENCY))
+            _limiters[model_name] = ModelLimiter(model_name, max_concurrency)
+        return _limiters[model_name]
+
+
+class PooledChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
+    """ChatGoogleGenerativeAI whose calls wait for a slot of the model's process-wide limiter."""
+
+    def _limiter(self) -> ModelLimiter:
+        # The client stores the name as "models/<name>"
+        return get_limiter(self.model.split('/')[-1])
+
+    def _with_timeout(self, kwargs: dict) -> dict:
+        # Passed through to the gRPC call as its deadline
+        timeout = kwargs.get('timeout') or self.timeout
+        remaining = remaining_budget()
+        if remaining is not None:
+            timeout = max(0.1, min(timeout or remaining, remaining))
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        return kwargs
+
+    def _generate(self, *args, **kwargs):
+        limiter = self._limiter()
+        started = limiter.acquire()
+        try:
+            result = super()._generate(*args, **self._with_timeout(kwargs))
+        except Exception as e:
+            limiter.release(started, e)
+            raise
+        limiter.release(started)
+        _meter_result(result)
+        return result
+
+    async def _agenerate(self, *args, **kwargs):
+        limiter = self._limiter()
+        started = await limiter.aacquire()
+        try:
+            result = await super()._agenerate(*args, **self._with_timeout(kwargs))
+        except Exception as e:
+            limiter.release(started, e)
+            raise
+        limiter.release(started)
+        _meter_result(result)
+        return result
+
+    def _stream(self, *args, **kwargs):
+        # The slot is held until the stream is exhausted or closed
+        limiter = self._limiter()
+        started = limiter.acquire()
+        error = None
+        try:
+            for chunk in super()._stream(*args, **self._with_timeout(kwargs)):
+                # Usage arrives on the stream's chunks as increments
+                _meter(chunk.message)
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            limiter.release(started, error)
+
+    async def _astream(self, *args, **kwargs):
+        limiter = self._limiter()
+        started = await limiter.aacquire()
+        error = None
+        try:
+            async for chunk in super()._astream(*args, **self._with_timeout(kwargs)):
+                _meter(chunk.message)
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            limiter.release(started, error)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm(model_name: str, temperature: float = 0) -> ChatGoogleGenerativeAI:
+    """
+    Returns the process-wide client for a model and temperature. Every module (and every
+    Streamlit rerun) shares it, so they share its gRPC channel instead of opening their own.
+    """
+    key = (model_name, temperature)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = PooledChatGoogleGenerativeAI(
+                model=model_name,
+                temperature=temperature,
+                api_key=get_secret("GEMINI_API_KEY"),
+                timeout=LLM_TIMEOUT_SECONDS
+            )
+        return _clients[key]
+
+
+def get_pool_stats() -> dict:
+    """{model: limiter counters} for every model used so far."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.model_name: limiter.get_stats() for limiter in limiters}
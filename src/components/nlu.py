@@ -1,17 +1,14 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 import os
 from pydantic import Field, BaseModel
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain.prompts import PromptTemplate
 import json
-import time
-from config import get_secret
+from retry import call_with_retry, acall_with_retry, LLM_POLICY
+from llm_clients import get_llm
+from telemetry import span
 
-model = ChatGoogleGenerativeAI(
-    model='gemini-2.0-flash-lite',
-    temperature=0,
-    api_key = get_secret("GEMINI_API_KEY")
-)
+# Shared with every other user of the model, see llm_clients
+model = get_llm('gemini-2.0-flash-lite', temperature=0)
 
 class ResponseSchema(BaseModel):
     actual_input: str = Field(description="The actual user input")
@@ -37,19 +34,63 @@ partial_variables={'response_schema': parser.get_format_instructions()}
 chain = prompt | model | parser
 
 
+class QueryPlan(BaseModel):
+    actual_input: str = Field(description="The actual user input")
+    user_intent: str = Field(description="What the user have asked for, paraphrased for the inventory agent")
+    tool_query: str = Field(description="A self-contained question to run against the inventory dataframe with the dataframe_scraper tool")
+
+plan_prompt = PromptTemplate(
+    template='''
+You are an expert in Natural Language Understanding for Inventory Management Domain.
+
+Understand what the user have asked and prepare the question for the dataframe_scraper tool,
+which answers questions by running pandas code on the inventory Excel sheet.
+The tool query must be self-contained and mention every item name, location and number the user gave.
+
+The user input: {text}
+''',
+input_variables=['text']
+)
+
+# NLU paraphrasing and tool selection in one structured-output call (lean pipeline)
+plan_chain = plan_prompt | model.with_structured_output(QueryPlan)
+
+
 def understand_the_user(user_text: str)-> json:
-    retries, max_retries = 0, 5
-    while(retries < max_retries):
-        try:
-            response = chain.invoke(input={"text": user_text})
-            return response
-
-        except Exception as e:
-            print(e)
-            retries +=1
-            time.sleep(5 * retries)
-
-    return None
+    try:
+        with span("nlu", call="understand_the_user"):
+            return call_with_retry(chain.invoke, input={"text": user_text}, policy=LLM_POLICY, name="understand_the_user")
+    except Exception as e:
+        print(e)
+        return None
+
+
+def plan_the_query(user_text: str) -> QueryPlan:
+    try:
+        with span("nlu", call="plan_the_query"):
+            return call_with_retry(plan_chain.invoke, input={"text": user_text}, policy=LLM_POLICY, name="plan_the_query")
+    except Exception as e:
+        print(e)
+        return None
+
+
+
+async def aunderstand_the_user(user_text: str) -> ResponseSchema:
+    try:
+        with span("nlu", call="aunderstand_the_user"):
+            return await acall_with_retry(chain.ainvoke, input={"text": user_text}, policy=LLM_POLICY, name="aunderstand_the_user")
+    except Exception as e:
+        print(e)
+        return None
+
+
+async def aplan_the_query(user_text: str) -> QueryPlan:
+    try:
+        with span("nlu", call="aplan_the_query"):
+            return await acall_with_retry(plan_chain.ainvoke, input={"text": user_text}, policy=LLM_POLICY, name="aplan_the_query")
+    except Exception as e:
+        print(e)
+        return None
         
 
 if __name__ == '__main__':
@@ -0,0 +1,461 @@
+import time
+import asyncio
+from typing import Dict, Any
+from config import get_secret
+from retry import request_deadline, call_with_retry, LLM_POLICY
+from telemetry import span, record_span, set_query
+from answer_cache import answer_cache
+from nlu import understand_the_user, plan_the_query, aunderstand_the_user, aplan_the_query
+from agent import retriever, lean_retriever, aretriever, alean_retriever
+from agent import OutputSchema, dataframe_scraper, select_tool_query, stream_paraphrase, cache_answer
+from fast_path import answer_fast_path
+from stt import aconvert_speech_to_text
+from tts import asynthesize, audio_seconds, IncrementalSpeaker, SYNTHESIZERS
+from jobs import job_queue, JobCancelled
+from llm_clients import TokenMeter, meter_tokens
+from quota import quota, QuotaExceeded, ESTIMATED_QUERY_TOKENS, PRESSURE_THRESHOLD
+
+# standard: NLU paraphrase -> tool selection -> pandas agent -> LLM formatting
+# lean: one structured NLU + tool query call -> pandas agent -> local formatting
+PIPELINE_MODES = {
+    "standard": "Standard (NLU, tool selection and formatting as separate calls)",
+    "lean": "Lean (single planning call, local formatting)",
+}
+DEFAULT_PIPELINE_MODE = get_secret("PIPELINE_MODE", "standard")
+
+
+def _notify(on_status, text: str):
+    if on_status is not None:
+        on_status(text)
+
+
+def answer_query(user_text: str, mode: str = None, on_status=None) -> Dict[str, Any]:
+    """
+    Runs a user question through the fast path, then the selected LLM pipeline.
+    All retries made while answering share one REQUEST_DEADLINE_SECONDS budget.
+
+    Returns a dict with:
+        success, final_answer, error
+        stage: 'quota', 'nlu' or 'agent', the stage that failed (quota: no budget left, retry later)
+        source: 'fast_path' or the pipeline mode that produced the answer
+        response: the OutputSchema of the answer
+    """
+    with request_deadline(), span("request", mode=mode or DEFAULT_PIPELINE_MODE) as current:
+        result = _answer_query(user_text, mode, on_status)
+        current.set(source=result['source'], success=result['success'], failed_stage=result['stage'])
+        return result
+
+
+def _check_mode(mode: str) -> str:
+    mode = mode or DEFAULT_PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode: {mode}")
+    return mode
+
+
+def _admission_mode(mode: str) -> str:
+    # Under quota pressure the question is answered in lean mode: one planning call, and the
+    # answer cache is checked before the agent runs
+    if mode != "lean" and quota.pressure() >= PRESSURE_THRESHOLD:
+        return "lean"
+    return mode
+
+
+def _on_queue(on_status):
+    return lambda seconds: _notify(on_status, f"Busy right now, waiting for capacity (~{seconds:.0f}s)...")
+
+
+def _admit(mode: str, on_status) -> tuple:
+    """
+    Reserves the estimated Gemini tokens for one question, queueing while the buckets refill.
+    Returns (mode, reserved tokens), the mode switches to lean under quota pressure.
+    """
+    mode = _admission_mode(mode)
+    reserved = ESTIMATED_QUERY_TOKENS[mode]
+    admission = quota.acquire("gemini_tokens", reserved, on_wait=_on_queue(on_status))
+    if not admission.allowed:
+        raise QuotaExceeded("gemini_tokens", admission.retry_after)
+    return mode, reserved
+
+
+async def _aadmit(mode: str, on_status) -> tuple:
+    mode = _admission_mode(mode)
+    reserved = ESTIMATED_QUERY_TOKENS[mode]
+    admission = await quota.aacquire("gemini_tokens", reserved, on_wait=_on_queue(on_status))
+    if not admission.allowed:
+        raise QuotaExceeded("gemini_tokens", admission.retry_after)
+    return mode, reserved
+
+
+def _quota_error(result: dict, e: QuotaExceeded):
+    result.update(stage='quota', error=f"The assistant is handling a lot of requests. Please try again in about {max(1, round(e.retry_after))} seconds.")
+
+
+def _new_result(user_text: str):
+    """Returns the empty result dict, already filled in if the fast path knows the answer."""
+    result = {
+        'success': False,
+        'final_answer': None,
+        'error': None,
+        'stage': None,
+        'source': None,
+        'response': None
+    }
+
+    # Common questions are answered straight from the inventory, no LLM calls
+    with span("fast_path") as current:
+        fast_response = answer_fast_path(user_text)
+        current.set(hit=fast_response is not None)
+    if fast_response is not None:
+        result.update(success=True, final_answer=fast_response.paraphrased_output,
+                      source='fast_path', response=fast_response)
+    return result
+
+
+def _answer_query(user_text: str, mode: str, on_status) -> Dict[str, Any]:
+    mode = _check_mode(mode)
+    result = _new_result(user_text)
+    if result['success']:
+        return result
+
+    try:
+        mode, reserved = _admit(mode, on_status)
+    except QuotaExceeded as e:
+        _quota_error(result, e)
+        return result
+    with meter_tokens() as meter:
+        try:
+            return _answer_with_llm(user_text, mode, result, on_status)
+        finally:
+            quota.settle("gemini_tokens", reserved, meter.used(reserved))
+
+
+def _answer_with_llm(user_text: str, mode: str, result: dict, on_status) -> Dict[str, Any]:
+    _notify(on_status, "Understanding your request...")
+    if mode == "lean":
+        plan = plan_the_query(user_text)
+        tool_query = plan.tool_query if plan is not None else None
+    else:
+        nlu_response = understand_the_user(user_text)
+        tool_query = nlu_response.user_intent if nlu_response is not None else None
+
+    if tool_query is None:
+        result.update(stage='nlu', error="Failed to understand your request. Please try again.")
+        return result
+
+    _notify(on_status, "Searching inventory database...")
+    if mode == "lean":
+        agent_response = lean_retriever(tool_query)
+    else:
+        agent_response = retriever(tool_query)
+
+    if agent_response is None:
+        result.update(stage='agent', error="Failed to retrieve data from inventory. Please try again.")
+        return result
+
+    result.update(success=True, final_answer=agent_response.paraphrased_output,
+                  source=mode, response=agent_response)
+    return result
+
+
+class StreamedAnswer:
+    """
+    An answer whose final paraphrase is streamed token by token.
+
+    prepare() runs the blocking stages (fast path, NLU, tool call), iterating
+    then yields the answer text as the model produces it. Once iteration is
+    done `result` holds the same dict as answer_query returns.
+    """
+
+    def __init__(self, user_text: str, mode: str = None, on_status=None):
+        self.user_text = user_text
+        self.mode = _check_mode(mode)
+        self.on_status = on_status
+        self.result = None
+        self._chunks = None
+        self._tool_query = None
+        self._tool_result = None
+        self._started_ns = None
+        self._meter = TokenMeter()
+        self._reserved = None
+
+    def prepare(self):
+        if self._chunks is None:
+            self._started_ns = time.time_ns()
+            with request_deadline(), meter_tokens(self._meter):
+                try:
+                    self._chunks = self._prepare()
+                except BaseException:
+                    # e.g. JobCancelled from a status update, the reservation must not leak
+                    self._settle()
+                    raise
+        return self
+
+    def _settle(self):
+        """Replaces the token reservation with the tokens actually used, once."""
+        if self._reserved is not None:
+            quota.settle("gemini_tokens", self._reserved, self._meter.used(self._reserved))
+            self._reserved = None
+
+    def _prepare(self):
+        self.result = _new_result(self.user_text)
+        if self.result['success']:
+            return iter([self.result['final_answer']])
+
+        try:
+            self.mode, self._reserved = _admit(self.mode, self.on_status)
+        except QuotaExceeded as e:
+            _quota_error(self.result, e)
+            return iter(())
+
+        _notify(self.on_status, "Understanding your request...")
+        if self.mode == "lean":
+            plan = plan_the_query(self.user_text)
+            tool_query = plan.tool_query if plan is not None else None
+        else:
+            nlu_response = understand_the_user(self.user_text)
+            tool_query = nlu_response.user_intent if nlu_response is not None else None
+
+        if tool_query is None:
+            self.result.update(stage='nlu', error="Failed to understand your request. Please try again.")
+            return iter(())
+
+        _notify(self.on_status, "Searching inventory database...")
+        if self.mode == "lean":
+            # Lean mode formats locally, there is nothing to stream
+            agent_response = lean_retriever(tool_query)
+            self.result.update(source=self.mode, response=agent_response)
+            return iter([agent_response.paraphrased_output])
+
+        cached_response = answer_cache.get(tool_query)
+        if cached_response is not None:
+            self.result.update(source=self.mode, response=cached_response)
+            return iter([cached_response.paraphrased_output])
+
+        try:
+            scraper_query = call_with_retry(select_tool_query, tool_query, policy=LLM_POLICY, name="select_tool_query")
+        except Exception as e:
+            print(f"Error selecting tool: {e}")
+            self.result.update(stage='agent', error="Failed to retrieve data from inventory. Please try again.")
+            return iter(())
+
+        self._tool_query = tool_query
+        with span("tool_call"):
+            self._tool_result = dataframe_scraper.invoke({"query": scraper_query})
+        self.result['source'] = self.mode
+        _notify(self.on_status, "Preparing response...")
+        return stream_paraphrase(tool_query, self._tool_result)
+
+    def __iter__(self):
+        self.prepare()
+        text = ""
+        try:
+            while True:
+                # Set around each step only, the generator may be resumed from another context
+                with meter_tokens(self._meter):
+                    chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                text += chunk
+                yield chunk
+        finally:
+            self._settle()
+        self._finish(text)
+        record_span("request", self._started_ns, mode=self.mode, streamed=True, source=self.result['source'],
+                    success=self.result['success'], failed_stage=self.result['stage'])
+
+    def _finish(self, text: str):
+        if self.result['error'] is not None:
+            return
+        if not text.strip():
+            self.result.update(stage='agent', error="Failed to retrieve data from inventory. Please try again.")
+            return
+
+        if self.result['response'] is None:
+            self.result['response'] = OutputSchema(query=self._tool_query, response=str(self._tool_result), paraphrased_output=text)
+            cache_answer(self._tool_query, self._tool_result, self.result['response'])
+        self.result.update(success=True, final_answer=text)
+
+
+def stream_query(user_text: str, mode: str = None, on_status=None) -> StreamedAnswer:
+    """
+    Streaming counterpart of answer_query, see StreamedAnswer.
+    """
+    return StreamedAnswer(user_text, mode, on_status)
+
+
+def _publish_audio(job, audio_chunks, voice_method: str):
+    """Adds synthesized sentences to the job as they become ready, the UI plays them in order."""
+    try:
+        for audio in audio_chunks:
+            if audio:
+                job.add_audio(audio, audio_seconds(audio, voice_method))
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Error generating speech: {e}")
+
+
+def _run_query_job(job, user_text: str, mode: str, voice_method: str) -> Dict[str, Any]:
+    answer = StreamedAnswer(user_text, mode, on_status=job.set_progress).prepare()
+    speaker = IncrementalSpeaker(voice_method) if voice_method in SYNTHESIZERS else None
+    try:
+        for chunk in (speaker.wrap(answer) if speaker else answer):
+            job.append(chunk)
+            if speaker is not None:
+                _publish_audio(job, speaker.ready_audio(), voice_method)
+    finally:
+        # Cancelled mid-stream: don't wait for the abandoned generator to be collected
+        answer._settle()
+
+    result = dict(answer.result, audio=None)
+    if result['success'] and speaker is not None:
+        _publish_audio(job, speaker.iter_audio(), voice_method)
+        try:
+            result['audio'] = {'method': voice_method, 'bytes': speaker.finish()}
+        except Exception as e:
+            print(f"Error generating speech: {e}")
+    return result
+
+
+def submit_query(user_text: str, mode: str = None, voice_method: str = None) -> str:
+    """
+    Answers in the background job pool and returns the job ID. Poll job_queue.status(job_id)
+    for progress, the streamed text and the audio of each sentence synthesized so far; once done,
+    its result is the answer_query dict plus audio ({'method', 'bytes'} when voice_method is set).
+    """
+    _check_mode(mode)
+    return job_queue.submit("query", _run_query_job, user_text, mode, voice_method)
+
+
+async def aanswer_query(user_text: str, mode: str = None, on_status=None) -> Dict[str, Any]:
+    """
+    Async counterpart of answer_query, returns the same result dict.
+    """
+    with request_deadline(), span("request", mode=mode or DEFAULT_PIPELINE_MODE) as current:
+        result = await _aanswer_query(user_text, mode, on_status)
+        current.set(source=result['source'], success=result['success'], failed_stage=result['stage'])
+        return result
+
+
+async def _aanswer_query(user_text: str, mode: str, on_status) -> Dict[str, Any]:
+    mode = _check_mode(mode)
+    result = _new_result(user_text)
+    if result['success']:
+        return result
+
+    try:
+        mode, reserved = await _aadmit(mode, on_status)
+    except QuotaExceeded as e:
+        _quota_error(result, e)
+        return result
+    with meter_tokens() as meter:
+        try:
+            return await _aanswer_with_llm(user_text, mode, result, on_status)
+        finally:
+            quota.settle("gemini_tokens", reserved, meter.used(reserved))
+
+
+async def _aanswer_with_llm(user_text: str, mode: str, result: dict, on_status) -> Dict[str, Any]:
+    _notify(on_status, "Understanding your request...")
+    if mode == "lean":
+        plan = await aplan_the_query(user_text)
+        tool_query = plan.tool_query if plan is not None else None
+    else:
+        nlu_response = await aunderstand_the_user(user_text)
+        tool_query = nlu_response.user_intent if nlu_response is not None else None
+
+    if tool_query is None:
+        result.update(stage='nlu', error="Failed to understand your request. Please try again.")
+        return result
+
+    _notify(on_status, "Searching inventory database...")
+    if mode == "lean":
+        agent_response = await alean_retriever(tool_query)
+    else:
+        agent_response = await aretriever(tool_query)
+
+    if agent_response is None:
+        result.update(stage='agent', error="Failed to retrieve data from inventory. Please try again.")
+        return result
+
+    result.update(success=True, final_answer=agent_response.paraphrased_output,
+                  source=mode, response=agent_response)
+    return result
+
+
+async def arun_voice_pipeline(audio_file_path: str, mode: str = None, voice_method: str = "gtts") -> Dict[str, Any]:
+    """
+    STT -> NLU -> agent -> TTS for one recorded question, all on the event loop.
+
+    Returns the answer_query result dict plus:
+        transcript: the recognised text
+        audio: the synthesized answer (None if voice_method is None or synthesis failed)
+        timings: seconds spent per stage
+    Every stage is also recorded as a telemetry span under one "voice_request" span.
+    """
+    with span("voice_request", mode=mode or DEFAULT_PIPELINE_MODE, voice_method=voice_method) as current:
+        result = await _arun_voice_pipeline(audio_file_path, mode, voice_method)
+        current.set(success=result['success'], failed_stage=result['stage'], **{f"{stage}_seconds": seconds for stage, seconds in result['timings'].items()})
+        return result
+
+
+async def _arun_voice_pipeline(audio_file_path: str, mode: str, voice_method: str) -> Dict[str, Any]:
+    timings = {}
+    with request_deadline():
+        start_time = time.perf_counter()
+        transcript, _ = await aconvert_speech_to_text(audio_file_path)
+        timings['stt'] = time.perf_counter() - start_time
+
+        if not transcript:
+            return {'success': False, 'final_answer': None, 'error': "Failed to transcribe the audio.",
+                    'stage': 'stt', 'source': None, 'response': None,
+                    'transcript': transcript, 'audio': None, 'timings': timings}
+
+        set_query(transcript)
+        start_time = time.perf_counter()
+        result = await _aanswer_query(transcript, mode, None)
+        timings['answer'] = time.perf_counter() - start_time
+
+    audio = None
+    if result['success'] and voice_method:
+        start_time = time.perf_counter()
+        try:
+            audio = await asynthesize(result['final_answer'], voice_method)
+        except Exception as e:
+            print(f"Error generating speech: {e}")
+        timings['tts'] = time.perf_counter() - start_time
+
+    result.update(transcript=transcript, audio=audio, timings=timings)
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    from answer_cache import answer_cache
+    from telemetry import telemetry
+    from llm_clients import get_pool_stats
+
+    question = " ".join(sys.argv[1:]) or "Which items in the QC Lab are damaged?"
+    for pipeline_mode in PIPELINE_MODES:
+        answer_cache.clear()
+        start_time = time.time()
+        answer = answer_query(question, mode=pipeline_mode)
+        print(f"[{pipeline_mode}] {time.time() - start_time:.2f}s -> {answer['final_answer'] or answer['error']}")
+
+    # Several questions concurrently on one event loop
+    async def answer_all(questions):
+        return await asyncio.gather(*(aanswer_query(q) for q in questions))
+
+    answer_cache.clear()
+    start_time = time.time()
+    questions = [question, "Which items are under maintenance?", "How many items need goggles as PPE?"]
+    for q, answer in zip(questions, asyncio.run(answer_all(questions))):
+        print(f"[async] {q} -> {answer['final_answer'] or answer['error']}")
+    print(f"[async] {len(questions)} questions in {time.time() - start_time:.2f}s")
+
+    for stage, stats in telemetry.percentiles().items():
+        print(f"[telemetry] {stage}: n={stats['count']} p50={stats['p50_ms']:.1f} ms p95={stats['p95_ms']:.1f} ms")
+    for model_name, stats in get_pool_stats().items():
+        print(f"[llm pool] {model_name}: {stats['calls']} calls, peak {stats['peak_in_flight']}/{stats['max_concurrency']} in flight, "
+              f"avg wait {stats['average_wait_seconds'] * 1000:.1f} ms, rate limited {stats['rate_limited']}")
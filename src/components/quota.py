@@ -0,0 +1,226 @@
+import time
+import asyncio
+import threading
+import contextvars
+from collections import namedtuple
+from contextlib import contextmanager
+import streamlit as st
+from cache import LRUCache
+from config import get_secret
+
+# Budgets per minute; a bucket holds one minute's worth, so short bursts are fine
+# and sustained load is spread out instead of being cut off.
+RESOURCES = {
+    "gemini_tokens": {"global": 1_000_000, "user": 60_000},
+    "stt_seconds": {"global": 600, "user": 120},
+    "tts_characters": {"global": 200_000, "user": 20_000},
+}
+# Gemini tokens reserved for one question before its real usage is known
+ESTIMATED_QUERY_TOKENS = {"standard": 8000, "lean": 4000}
+# Characters reserved for voicing one answer
+ESTIMATED_ANSWER_CHARACTERS = 600
+# Above this fill level of any bucket the pipeline degrades: cache first, lean mode
+PRESSURE_THRESHOLD = float(get_secret("QUOTA_PRESSURE_THRESHOLD", 0.8))
+# How long a request may queue for budget before it is shed
+MAX_QUEUE_SECONDS = float(get_secret("QUOTA_MAX_QUEUE_SECONDS", 15))
+
+_current_user = contextvars.ContextVar('quota_user', default="anonymous")
+
+Admission = namedtuple('Admission', ['allowed', 'retry_after'])
+
+
+class QuotaExceeded(RuntimeError):
+    def __init__(self, resource: str, retry_after: float):
+        super().__init__(f"{resource} quota exhausted, try again in {retry_after:.0f}s")
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket: holds up to capacity, refills continuously at rate per second."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (inf if it never fits)."""
+        missing = min(amount, self.capacity) - self.available()
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float('inf')
+
+    def consume(self, amount: float):
+        # Callers check first; settling real usage may push the bucket into debt, repaid by refill
+        self._refill()
+        self._tokens -= amount
+
+    def usage(self) -> float:
+        """Fraction of the bucket in use, 0 (full) to 1 (empty or in debt)."""
+        return min(1.0, max(0.0, 1 - self.available() / self.capacity))
+
+
+class QuotaManager:
+    """
+    Process-wide token buckets per resource: one shared by everyone and one per user.
+    A request needs room in both. Buckets of idle users are dropped after an hour;
+    a returning user starts full, which is no more than a minute's budget.
+    """
+
+    def __init__(self, resources: dict):
+        self.resources = resources
+        self._lock = threading.Lock()
+        self._global = {name: self._bucket(limits['global']) for name, limits in resources.items()}
+        self._users = LRUCache(max_entries=10_000, ttl_seconds=3600)
+        self.stats = {'admitted': 0, 'queued': 0, 'shed': 0}
+
+    @staticmethod
+    def _bucket(per_minute: float) -> TokenBucket:
+        return TokenBucket(capacity=per_minute, rate=per_minute / 60)
+
+    def _user_buckets(self, user: str) -> dict:
+        buckets = self._users.get(user)
+        if buckets is None:
+            buckets = {name: self._bucket(limits['user']) for name, limits in self.resources.items()}
+        self._users.set(user, buckets)  # refreshes the idle timeout
+        return buckets
+
+    def _buckets(self, resource: str, user: str) -> tuple:
+        return self._global[resource], self._user_buckets(user)[resource]
+
+    def try_consume(self, resource: str, amount: float, user: str = None) -> Admission:
+        user = user or _current_user.get()
+        with self._lock:
+            buckets = self._buckets(resource, user)
+            retry_after = max(bucket.wait_time(amount) for bucket in buckets)
+            if retry_after > 0:
+                return Admission(False, retry_after)
+            for bucket in buckets:
+                bucket.consume(amount)
+            return Admission(True, 0.0)
+
+    def acquire(self, resource: str, amount: float, user: str = None, max_wait: float = MAX_QUEUE_SECONDS,
+                on_wait=None) -> Admission:
+        """
+        Consumes amount, queueing up to max_wait seconds for the buckets to refill.
+        Returns Admission(False, retry_after) when the request should be shed instead.
+        """
+        user = user or _current_user.get()
+        deadline = time.monotonic() + max_wait
+        queued = False
+        while True:
+            admission = self.try_consume(resource, amount, user)
+            if admission.allowed:
+                self._count('admitted')
+                return admission
+            if time.monotonic() + admission.retry_after > deadline:
+                self._count('shed')
+                return admission
+            if not queued:
+                queued = True
+                self._count('queued')
+            if on_wait is not None:
+                on_wait(admission.retry_after)
+            time.sleep(min(admission.retry_after, 1.0))
+
+    async def aacquire(self, resource: str, amount: float, user: str = None, max_wait: float = MAX_QUEUE_SECONDS,
+                       on_wait=None) -> Admission:
+        """acquire for event loops: queues with asyncio.sleep instead of holding an executor thread."""
+        user = user or _current_user.get()
+        deadline = time.monotonic() + max_wait
+        queued = False
+        while True:
+            admission = self.try_consume(resource, amount, user)
+            if admission.allowed:
+                self._count('admitted')
+                return admission
+            if time.monotonic() + admission.retry_after > deadline:
+                self._count('shed')
+                return admission
+            if not queued:
+                queued = True
+                self._count('queued')
+            if on_wait is not None:
+                on_wait(admission.retry_after)
+            await asyncio.sleep(min(admission.retry_after, 1.0))
+
+    def settle(self, resource: str, reserved: float, used: float, user: str = None):
+        """Corrects a reservation once the real usage is known (refunds or charges the difference)."""
+        user = user or _current_user.get()
+        with self._lock:
+            for bucket in self._buckets(resource, user):
+                bucket.consume(used - reserved)
+
+    def pressure(self, user: str = None) -> float:
+        """Highest fill level over every global and user bucket, 0 (idle) to 1 (exhausted)."""
+        user = user or _current_user.get()
+        with self._lock:
+            buckets = list(self._global.values()) + list(self._user_buckets(user).values())
+            return max(bucket.usage() for bucket in buckets)
+
+    def usage(self, user: str = None) -> dict:
+        """{resource: {'global', 'user'}} fill levels, for display."""
+        user = user or _current_user.get()
+        with self._lock:
+            user_buckets = self._user_buckets(user)
+            return {name: {'global': self._global[name].usage(), 'user': user_buckets[name].usage()}
+                    for name in self.resources}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+
+def _limits(name: str, limits: dict) -> dict:
+    prefix = f"QUOTA_{name.upper()}"
+    return {
+        'global': float(get_secret(f"{prefix}_GLOBAL_PER_MINUTE", limits['global'])),
+        'user': float(get_secret(f"{prefix}_USER_PER_MINUTE", limits['user'])),
+    }
+
+
+quota = QuotaManager({name: _limits(name, limits) for name, limits in RESOURCES.items()})
+
+
+@contextmanager
+def quota_user(user: str):
+    """Charges everything consumed inside the block (and in jobs started from it) to user."""
+    token = _current_user.set(user)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+def session_quota_user(session_id: str) -> str:
+    """
+    Who a Streamlit session's usage is charged to: the signed-in account if the app uses st.login,
+    otherwise the session. Not the client IP, every operator behind the company NAT would share
+    one bucket. The global bucket still bounds all sessions together.
+    """
+    return (st.user.get('email') if st.user.get('is_logged_in') else None) or session_id
+
+
+def charge(resource: str, amount: float, max_wait: float = MAX_QUEUE_SECONDS):
+    """Consumes budget for a call about to be made, raising QuotaExceeded if none frees up within max_wait."""
+    admission = quota.acquire(resource, amount, max_wait=max_wait)
+    if not admission.allowed:
+        raise QuotaExceeded(resource, admission.retry_after)
+
+
+async def acharge(resource: str, amount: float, max_wait: float = MAX_QUEUE_SECONDS):
+    """charge without blocking the event loop or an executor thread while queueing."""
+    admission = await quota.aacquire(resource, amount, max_wait=max_wait)
+    if not admission.allowed:
+        raise QuotaExceeded(resource, admission.retry_after)
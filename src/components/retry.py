@@ -0,0 +1,192 @@
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from config import get_secret
+
+# Errors that another attempt won't fix: bad model output, bad arguments, bad credentials
+FATAL_ERROR_NAMES = {
+    'OutputParserException', 'ValidationError', 'JSONDecodeError',
+    'InvalidArgument', 'PermissionDenied', 'Unauthenticated', 'NotFound',
+    # langchain_google_genai's wrapper, only raised for invalid requests (bad key, bad arguments)
+    'ChatGoogleGenerativeAIError',
+}
+# For wrappers that lose the original exception type
+FATAL_ERROR_MESSAGES = ('Invalid argument provided to Gemini', 'API key not valid', 'API_KEY_INVALID', 'PERMISSION_DENIED')
+FATAL_ERROR_TYPES = (ValueError, TypeError, KeyError, AttributeError, NotImplementedError)
+
+_request_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: attempt n waits uniform(0, min(max_delay, base_delay * 2 ** (n - 1))).
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+DEFAULT_POLICY = RetryPolicy(
+    max_attempts=int(get_secret("RETRY_MAX_ATTEMPTS", 4)),
+    base_delay=float(get_secret("RETRY_BASE_DELAY", 1.0)),
+    max_delay=float(get_secret("RETRY_MAX_DELAY", 8.0))
+)
+# langchain_google_genai already retries every Gemini call once (tenacity, 2 attempts with a 2 s+
+# backoff on any GoogleAPIError, max_retries isn't read), so Gemini stages get fewer outer attempts:
+# 2 x 2 calls at most, as many as DEFAULT_POLICY makes for other services
+LLM_POLICY = RetryPolicy(
+    max_attempts=int(get_secret("LLM_RETRY_MAX_ATTEMPTS", 2)),
+    base_delay=DEFAULT_POLICY.base_delay,
+    max_delay=DEFAULT_POLICY.max_delay
+)
+REQUEST_DEADLINE_SECONDS = float(get_secret("REQUEST_DEADLINE_SECONDS", 60))
+
+
+def _error_chain(error: Exception) -> list:
+    """The error followed by the errors it was raised from (__cause__ / __context__)."""
+    chain = []
+    while error is not None and error not in chain:
+        chain.append(error)
+        error = error.__cause__ or error.__context__
+    return chain
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, DeadlineExceeded):
+        return False
+    for cause in _error_chain(error):
+        if any(cls.__name__ in FATAL_ERROR_NAMES for cls in type(cause).__mro__):
+            return False
+        if any(message in str(cause) for message in FATAL_ERROR_MESSAGES):
+            return False
+    return not isinstance(error, FATAL_ERROR_TYPES)
+
+
+@contextmanager
+def request_deadline(seconds: float = None):
+    """
+    Sets an overall time budget shared by every retried call made inside the block.
+    Nested blocks can only shorten the budget.
+    """
+    seconds = REQUEST_DEADLINE_SECONDS if seconds is None else seconds
+    deadline = time.monotonic() + seconds
+    current = _request_deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def remaining_budget() -> float:
+    """Seconds left in the current request budget, or None if no deadline is set."""
+    deadline = _request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _call_within(fn, args, kwargs, timeout: float, name: str):
+    """
+    Runs fn in a worker thread and waits at most timeout seconds for it. A call still running
+    at the deadline is abandoned (its own client timeout ends it), the request moves on.
+    """
+    if timeout is None:
+        return fn(*args, **kwargs)
+    outcome = {}
+    finished = threading.Event()
+    context = contextvars.copy_context()
+
+    def attempt():
+        try:
+            outcome['result'] = context.run(fn, *args, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            finished.set()
+
+    threading.Thread(target=attempt, name=f"{name}-attempt", daemon=True).start()
+    if not finished.wait(timeout):
+        raise DeadlineExceeded(f"{name}: request deadline exceeded")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def _next_delay(policy: RetryPolicy, attempt: int, error: Exception, name: str):
+    """Returns how long to wait before the next attempt, or None to give up."""
+    if not is_retryable(error):
+        print(f"{name}: not retrying {type(error).__name__}: {error}")
+        return None
+    if attempt >= policy.max_attempts:
+        print(f"{name}: giving up after {attempt} attempts: {error}")
+        return None
+
+    delay = policy.delay(attempt)
+    remaining = remaining_budget()
+    if remaining is not None and delay >= remaining:
+        print(f"{name}: request deadline reached, giving up: {error}")
+        return None
+
+    print(f"{name}: attempt {attempt} failed ({error}), retrying in {delay:.2f}s")
+    return delay
+
+
+def call_with_retry(fn, *args, policy: RetryPolicy = None, name: str = None, **kwargs):
+    """
+    Calls fn(*args, **kwargs), retrying retryable errors with backoff within the request deadline.
+    Inside a request_deadline each attempt is also cut off at the deadline.
+    Re-raises the last error when the call can't succeed.
+    """
+    policy = policy or DEFAULT_POLICY
+    name = name or getattr(fn, '__name__', 'call')
+    attempt = 0
+    while True:
+        remaining = remaining_budget()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"{name}: request deadline exceeded")
+        attempt += 1
+        try:
+            return _call_within(fn, args, kwargs, remaining, name)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            delay = _next_delay(policy, attempt, e, name)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+async def acall_with_retry(fn, *args, policy: RetryPolicy = None, name: str = None, **kwargs):
+    """
+    Async counterpart of call_with_retry for coroutine functions, the deadline also bounds each attempt.
+    """
+    policy = policy or DEFAULT_POLICY
+    name = name or getattr(fn, '__name__', 'call')
+    attempt = 0
+    while True:
+        remaining = remaining_budget()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"{name}: request deadline exceeded")
+        attempt += 1
+        try:
+            return await asyncio.wait_for(fn(*args, **kwargs), timeout=remaining)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError) and remaining is not None and remaining_budget() <= 0:
+                raise DeadlineExceeded(f"{name}: request deadline exceeded") from e
+            delay = _next_delay(policy, attempt, e, name)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
@@ -0,0 +1,227 @@
+import json
+import time
+import wave
+from collections import deque
+import numpy as np
+
+try:
+    import speech_recognition as sr
+    SPEECH_RECOGNITION_AVAILABLE = True
+except ImportError:
+    SPEECH_RECOGNITION_AVAILABLE = False
+
+try:
+    import webrtcvad
+    WEBRTC_VAD_AVAILABLE = True
+except ImportError:
+    WEBRTC_VAD_AVAILABLE = False
+
+try:
+    import vosk
+    VOSK_AVAILABLE = True
+except ImportError:
+    VOSK_AVAILABLE = False
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30  # WebRTC VAD accepts 10, 20 or 30 ms frames
+SAMPLE_WIDTH = 2  # 16-bit PCM
+
+
+class EnergyVAD:
+    """
+    Voice activity detection from frame RMS energy.
+    The threshold adapts to the background level measured while nobody is speaking,
+    so there is no separate calibration pause before listening.
+
+    The background starts at the level min_threshold implies. After calibration_frames it is
+    set to a low percentile of those frames, which catches the pauses even if the user was
+    already talking when the microphone opened. The seed is capped at max_noise_level, so
+    speech can never become the background.
+    """
+
+    def __init__(self, sensitivity: float = 3.0, min_threshold: float = 300.0,
+                 calibration_frames: int = 10, max_noise_level: float = 300.0):
+        self.sensitivity = sensitivity
+        self.min_threshold = min_threshold
+        self.calibration_frames = calibration_frames
+        self.max_noise_level = max_noise_level
+        self.noise_level = min_threshold / sensitivity
+        self._calibration = []
+
+    def is_speech(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples ** 2))) if samples.size else 0.0
+        if self._calibration is not None:
+            self._calibration.append(rms)
+            if len(self._calibration) >= self.calibration_frames:
+                seed = float(np.percentile(self._calibration, 10))
+                self.noise_level = min(max(seed, self.noise_level), self.max_noise_level)
+                self._calibration = None
+        threshold = max(self.min_threshold, self.noise_level * self.sensitivity)
+        speech = rms > threshold
+        if not speech:
+            # Track the background slowly, speech frames don't move it
+            self.noise_level = 0.95 * self.noise_level + 0.05 * rms
+        return speech
+
+
+class WebRTCVAD:
+    """Voice activity detection using the WebRTC VAD (pip install webrtcvad)."""
+
+    def __init__(self, aggressiveness: int = 2, sample_rate: int = SAMPLE_RATE):
+        if not WEBRTC_VAD_AVAILABLE:
+            raise RuntimeError("webrtcvad not available. Install with: pip install webrtcvad")
+        self.vad = webrtcvad.Vad(aggressiveness)
+        self.sample_rate = sample_rate
+
+    def is_speech(self, frame: bytes) -> bool:
+        return self.vad.is_speech(frame, self.sample_rate)
+
+
+def default_vad():
+    return WebRTCVAD() if WEBRTC_VAD_AVAILABLE else EnergyVAD()
+
+
+class StreamingRecognizer:
+    """
+    Interface for recognizers fed with 16-bit mono PCM frames while the user speaks.
+    accept_frame may return a partial transcript, final returns the full one.
+    """
+
+    def reset(self):
+        pass
+
+    def accept_frame(self, frame: bytes) -> str:
+        return None
+
+    def final(self) -> str:
+        raise NotImplementedError
+
+
+class VoskStreamingRecognizer(StreamingRecognizer):
+    """Offline recognizer with real partial results (pip install vosk, plus a downloaded model)."""
+
+    def __init__(self, model_path: str = None, sample_rate: int = SAMPLE_RATE, model=None):
+        if not VOSK_AVAILABLE:
+            raise RuntimeError("vosk not available. Install with: pip install vosk")
+        self.sample_rate = sample_rate
+        # An already loaded model can be shared, loading one takes a while
+        self.model = model if model is not None else vosk.Model(model_path)
+        self.reset()
+
+    def reset(self):
+        self.recognizer = vosk.KaldiRecognizer(self.model, self.sample_rate)
+        self._text = []
+
+    def accept_frame(self, frame: bytes) -> str:
+        if self.recognizer.AcceptWaveform(frame):
+            self._text.append(json.loads(self.recognizer.Result()).get('text', ''))
+            return " ".join(self._text).strip()
+        partial = json.loads(self.recognizer.PartialResult()).get('partial', '')
+        return " ".join(self._text + [partial]).strip()
+
+    def final(self) -> str:
+        self._text.append(json.loads(self.recognizer.FinalResult()).get('text', ''))
+        return " ".join(self._text).strip()
+
+
+def transcribe_stream(frames, recognizer: StreamingRecognizer, vad=None, on_partial=None,
+                      frame_ms: int = FRAME_MS, start_timeout: float = 10.0, end_silence_ms: int = 600,
+                      max_utterance_s: float = 15.0, preroll_ms: int = 300) -> str:
+    """
+    Feeds PCM frames to the recognizer between VAD start and end of speech.
+
+    Speech starts after a few consecutive voiced frames (the frames just before are
+    kept, so the first word isn't clipped) and ends after end_silence_ms of silence,
+    so recognition starts the moment the user stops talking instead of after a fixed timeout.
+    Returns None if nobody speaks within start_timeout seconds.
+    """
+    vad = vad or default_vad()
+    recognizer.reset()
+
+    start_frames = 3
+    end_frames = max(1, end_silence_ms // frame_ms)
+    max_frames = int(max_utterance_s * 1000 / frame_ms)
+    preroll = deque(maxlen=max(1, preroll_ms // frame_ms))
+
+    voiced_run, silent_run, speech_frames = 0, 0, 0
+    in_speech = False
+    started_at = time.monotonic()
+
+    for frame in frames:
+        speech = vad.is_speech(frame)
+
+        if not in_speech:
+            preroll.append(frame)
+            voiced_run = voiced_run + 1 if speech else 0
+            if voiced_run >= start_frames:
+                in_speech = True
+                for buffered in preroll:
+                    partial = recognizer.accept_frame(buffered)
+                speech_frames = len(preroll)
+                if partial and on_partial:
+                    on_partial(partial)
+            elif time.monotonic() - started_at > start_timeout:
+                return None
+            continue
+
+        partial = recognizer.accept_frame(frame)
+        if partial and on_partial:
+            on_partial(partial)
+        speech_frames += 1
+        silent_run = 0 if speech else silent_run + 1
+        if silent_run >= end_frames or speech_frames >= max_frames:
+            break
+
+    if not in_speech:
+        return None
+    return recognizer.final()
+
+
+def microphone_frames(sample_rate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS):
+    """Yields fixed-size 16-bit mono PCM frames from the default microphone."""
+    if not SPEECH_RECOGNITION_AVAILABLE:
+        raise RuntimeError("speech_recognition not available. Install with: pip install SpeechRecognition pyaudio")
+
+    frame_samples = sample_rate * frame_ms // 1000
+    with sr.Microphone(sample_rate=sample_rate, chunk_size=frame_samples) as source:
+        while True:
+            yield source.stream.read(frame_samples)
+
+
+def wav_frames(audio_file_path: str, frame_ms: int = FRAME_MS):
+    """Yields PCM frames from a 16-bit mono WAV file, for testing the streaming path offline."""
+    with wave.open(audio_file_path, 'rb') as wf:
+        if wf.getsampwidth() != SAMPLE_WIDTH or wf.getnchannels() != 1:
+            raise ValueError("Expected a 16-bit mono WAV file")
+        frame_samples = wf.getframerate() * frame_ms // 1000
+        while True:
+            frame = wf.readframes(frame_samples)
+            if len(frame) < frame_samples * SAMPLE_WIDTH:
+                break
+            yield frame
+
+
+def listen_and_transcribe(recognizer: StreamingRecognizer = None, on_partial=None, **kwargs) -> str:
+    """
+    Listens on the microphone until the end of the utterance and returns its transcript.
+    By default the utterance goes to the STT_BACKEND (preprocessing, transcript cache and quota included).
+    """
+    if recognizer is None:
+        # stt_backends builds on this module
+        from stt_backends import get_stt_backend
+        recognizer = get_stt_backend().streaming_recognizer()
+    return transcribe_stream(microphone_frames(), recognizer, on_partial=on_partial, **kwargs)
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 2:
+        # python streaming_stt.py <16 kHz mono wav> <vosk model dir>
+        text = transcribe_stream(wav_frames(sys.argv[1]), VoskStreamingRecognizer(sys.argv[2]),
+                                 on_partial=lambda partial: print(f"... {partial}"))
+    else:
+        print("Speak now...")
+        text = listen_and_transcribe(on_partial=lambda partial: print(f"... {partial}"))
+    print(f"Transcription: {text}")
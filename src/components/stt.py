@@ -1,7 +1,12 @@
 import assemblyai as aai
+import os
+import json
 import wave
 from config import get_secret
+from stt_backends import get_stt_backend
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     aai.settings.api_key = get_secret("ASSEMBLYAI_API_KEY")
@@ -9,30 +14,53 @@ except Exception as e:
     print(e)
     raise 
 
+def transcribe_with_assemblyai(audio_file) -> aai.Transcript:
+    """Transcribes a file path, URL or binary file object, raising if AssemblyAI reports an error."""
+    config = aai.TranscriptionConfig(speech_model=aai.SpeechModel.best)
+    transcriber = aai.Transcriber(config=config)
+    if hasattr(audio_file, 'seek'):
+        audio_file.seek(0)  # the upload reads the file, a retry has to start over
+    transcript = transcriber.transcribe(audio_file)
+    if transcript.status == "error":
+        raise RuntimeError(f"Transcription failed: {transcript.error}")
+    return transcript
+
 def convert_speech_to_text(audio_file_path: str):
-    retries, max_retries = 0, 5
-    while (retries < max_retries):
-        try:
-            start_time = time.time()
-
-            config = aai.TranscriptionConfig(speech_model=aai.SpeechModel.best)
-            transcriber = aai.Transcriber(config=config)
-            transcript = transcriber.transcribe(audio_file_path)
-            if transcript.status == "error":
-                raise RuntimeError(f"Transcription failed: {transcript.error}")
-            
-            end_time = time.time()
-
-            return transcript.text, (end_time - start_time)
-
-        except Exception as e:
-            print(e)
-            retries += 1
-            time.sleep(5 * retries)
-
-    return None, None
+    # Preprocessing, retries and the transcript cache live in the backend
+    try:
+        start_time = time.time()
+        text = get_stt_backend("assemblyai").transcribe(audio_file_path).text
+        end_time = time.time()
+        return text, (end_time - start_time)
+
+    except Exception as e:
+        print(e)
+        return None, None
     
 
+async def atranscribe_with_assemblyai(audio_file) -> aai.Transcript:
+    config = aai.TranscriptionConfig(speech_model=aai.SpeechModel.best)
+    transcriber = aai.Transcriber(config=config)
+    if hasattr(audio_file, 'seek'):
+        audio_file.seek(0)
+    # The SDK polls in its own worker thread, await it without blocking the event loop
+    transcript = await asyncio.wrap_future(transcriber.transcribe_async(audio_file))
+    if transcript.status == "error":
+        raise RuntimeError(f"Transcription failed: {transcript.error}")
+    return transcript
+
+async def aconvert_speech_to_text(audio_file_path: str):
+    try:
+        start_time = time.time()
+        text = (await get_stt_backend("assemblyai").atranscribe(audio_file_path)).text
+        end_time = time.time()
+        return text, (end_time - start_time)
+
+    except Exception as e:
+        print(e)
+        return None, None
+
+
 def get_wav_duration(audio_file_path):
     try:
         with wave.open(audio_file_path, 'rb') as wf:
@@ -46,13 +74,94 @@ def get_wav_duration(audio_file_path):
     
 
 
+# Batch mode reports durations and RTF from get_wav_duration, so it only takes WAV files
+AUDIO_EXTENSIONS = ('.wav',)
+
+
+def read_manifest(manifest_path: str) -> list:
+    """One audio path per line, or JSON lines with a "path" field; relative paths are relative to the manifest."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    paths = []
+    with open(manifest_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = json.loads(line)['path'] if line.startswith('{') else line
+            paths.append(os.path.join(base_dir, path))
+    return paths
+
+
+def find_audio_files(directory: str) -> list:
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names if name.lower().endswith(AUDIO_EXTENSIONS)
+    )
+
+
+def _transcribe_for_batch(audio_file_path: str, backend_name: str) -> dict:
+    record = {'path': audio_file_path, 'backend': backend_name, 'duration': get_wav_duration(audio_file_path)}
+    start_time = time.time()
+    try:
+        # Not metered: the per-user STT quota would queue the workers and the wait would land in latency and RTF
+        result = get_stt_backend(backend_name).transcribe(audio_file_path, metered=False)
+        record.update(text=result.text, confidence=result.confidence, error=None)
+    except Exception as e:
+        record.update(text=None, confidence=None, error=str(e))
+    record['latency'] = time.time() - start_time
+    record['rtf'] = record['latency'] / record['duration'] if record['duration'] else None
+    return record
+
+
+def transcribe_batch(audio_file_paths: list, output_path: str, backend_name: str = "assemblyai", max_workers: int = 4) -> list:
+    """
+    Transcribes the files with at most max_workers jobs in flight and appends one JSON line
+    per file to output_path as soon as it finishes. Returns the records in input order.
+    """
+    records = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt-batch") as executor, \
+            open(output_path, 'a', encoding='utf-8') as output:
+        futures = {executor.submit(_transcribe_for_batch, path, backend_name): path for path in audio_file_paths}
+        for future in as_completed(futures):
+            record = future.result()
+            records[futures[future]] = record
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            status = f"RTF {record['rtf']:.3f}" if record['rtf'] is not None else "RTF n/a"
+            print(f"[{len(records)}/{len(futures)}] {record['path']}: {record['latency']:.2f}s, {status}"
+                  + (f", error: {record['error']}" if record['error'] else ""))
+    return [records[path] for path in audio_file_paths]
+
+
 if __name__ == '__main__':
-    audio_file_path = './data/audios/harvard.wav'
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Transcribe one WAV file, a directory of them, or a manifest")
+    parser.add_argument('inputs', nargs='*', default=['./data/audios/harvard.wav'],
+                        help="WAV files or directories (searched recursively)")
+    parser.add_argument('--manifest', help="file listing WAV paths, one per line or JSON lines with a 'path' field")
+    parser.add_argument('--output', default='transcripts.jsonl', help="JSONL file results are appended to")
+    parser.add_argument('--backend', default='assemblyai', help="STT backend (assemblyai, google, vosk)")
+    parser.add_argument('--workers', type=int, default=4, help="transcriptions running in parallel")
+    args = parser.parse_args()
+
+    audio_file_paths = read_manifest(args.manifest) if args.manifest else []
+    if not args.manifest:
+        for path in args.inputs:
+            audio_file_paths.extend(find_audio_files(path) if os.path.isdir(path) else [path])
+    skipped = [path for path in audio_file_paths if not path.lower().endswith(AUDIO_EXTENSIONS)]
+    if skipped:
+        print(f"Skipping {len(skipped)} non-WAV files: {', '.join(skipped)}")
+        audio_file_paths = [path for path in audio_file_paths if path.lower().endswith(AUDIO_EXTENSIONS)]
 
-    audio_file_length = get_wav_duration(audio_file_path=audio_file_path)
-    transcription , elapsed_time = convert_speech_to_text(audio_file_path=audio_file_path)
+    start_time = time.time()
+    records = transcribe_batch(audio_file_paths, args.output, args.backend, args.workers)
+    elapsed_time = time.time() - start_time
 
-    print("Video Transcribed!!")
-    print(f"Video Length: {audio_file_length:.2f} seconds.")
-    print(f"Time Taken by AssemblyAI API: {elapsed_time:.2f} seconds.")
-    print(f"Transcription:\n{transcription}")
+    succeeded = [record for record in records if record['error'] is None]
+    audio_seconds = sum(record['duration'] or 0 for record in succeeded)
+    print(f"Transcribed {len(succeeded)}/{len(records)} files ({audio_seconds:.2f}s of audio) in {elapsed_time:.2f}s.")
+    if audio_seconds:
+        print(f"Batch real-time factor: {elapsed_time / audio_seconds:.3f}")
+    print(f"Results written to {args.output}")
@@ -0,0 +1,269 @@
+import io
+import json
+import asyncio
+import threading
+import time
+import wave
+from collections import namedtuple
+from config import get_secret
+from retry import call_with_retry, acall_with_retry
+from cache import LRUCache
+from telemetry import span
+from quota import charge, acharge
+from audio_preprocess import normalize_for_stt, encode_audio, UPLOAD_FORMAT
+from streaming_stt import StreamingRecognizer, VoskStreamingRecognizer, SAMPLE_RATE, SAMPLE_WIDTH
+
+try:
+    import speech_recognition as sr
+    SPEECH_RECOGNITION_AVAILABLE = True
+except ImportError:
+    SPEECH_RECOGNITION_AVAILABLE = False
+
+try:
+    import vosk
+    VOSK_AVAILABLE = True
+except ImportError:
+    VOSK_AVAILABLE = False
+
+Transcription = namedtuple('Transcription', ['text', 'confidence', 'seconds', 'backend'])
+
+# Streamlit reruns and user retries resubmit the same recording, each distinct audio is only sent once.
+# Keyed by (backend, digest of the normalized PCM), the value is the original Transcription with its timing.
+transcript_cache = LRUCache(
+    max_entries=int(get_secret("STT_CACHE_MAX_ENTRIES", 512)),
+    ttl_seconds=float(get_secret("STT_CACHE_TTL_SECONDS", 3600))
+)
+
+
+class NoSpeechError(Exception):
+    """The audio was processed but no speech could be recognised in it."""
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(SAMPLE_WIDTH)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return output.getvalue()
+
+
+class SpeechToText:
+    """
+    Common interface of the speech-to-text backends.
+    transcribe() takes a whole recording (a path, a binary file object such as st.audio_input's
+    UploadedFile, or bytes), streaming_recognizer() is used by the VAD microphone path.
+    metered=False skips the STT quota, for offline tools that aren't serving a user (batch mode).
+    """
+    name = None
+    # Remote backends charge the recording's length to the STT quota (cache hits are free)
+    metered = False
+    # Recordings are preprocessed (16 kHz mono, silence trimmed) and encoded in this format first
+    input_format = "wav"
+
+    def _transcribe(self, audio) -> tuple:
+        """Returns (text, confidence) for the recording."""
+        raise NotImplementedError
+
+    async def _atranscribe(self, audio) -> tuple:
+        return await asyncio.to_thread(self._transcribe, audio)
+
+    def _result(self, key, text: str, confidence, seconds: float) -> Transcription:
+        if not text or not text.strip():
+            raise NoSpeechError("No speech recognised in the audio")
+        result = Transcription(text.strip(), confidence, seconds, self.name)
+        transcript_cache.set(key, result)
+        return result
+
+    @staticmethod
+    def _seconds(prepared) -> float:
+        # Without pydub the length is unknown, assume 16 kHz 16-bit mono
+        return prepared.seconds or len(prepared.data) / (SAMPLE_RATE * SAMPLE_WIDTH)
+
+    @staticmethod
+    def _trace(current, normalized, seconds: float, prepared=None):
+        # A cache hit is never encoded, so it uploads nothing
+        current.set(cached=prepared is None, upload_bytes=len(prepared.data) if prepared else 0,
+                    audio_seconds=normalized.seconds)
+        if normalized.seconds:
+            current.set(rtf=seconds / normalized.seconds)
+
+    def transcribe(self, audio, metered: bool = True) -> Transcription:
+        start_time = time.perf_counter()
+        # The cache is keyed on the normalized PCM, only a miss pays for encoding the upload
+        normalized = normalize_for_stt(audio)
+        key = (self.name, normalized.digest)
+        with span("stt", backend=self.name) as current:
+            cached = transcript_cache.get(key)
+            if cached is not None:
+                self._trace(current, normalized, time.perf_counter() - start_time)
+                return cached
+            prepared = encode_audio(normalized, self.input_format)
+            if metered and self.metered:
+                charge("stt_seconds", self._seconds(prepared))
+            text, confidence = self._transcribe(io.BytesIO(prepared.data))
+            seconds = time.perf_counter() - start_time
+            self._trace(current, normalized, seconds, prepared)
+            return self._result(key, text, confidence, seconds)
+
+    async def atranscribe(self, audio, metered: bool = True) -> Transcription:
+        start_time = time.perf_counter()
+        normalized = await asyncio.to_thread(normalize_for_stt, audio)
+        key = (self.name, normalized.digest)
+        with span("stt", backend=self.name) as current:
+            cached = transcript_cache.get(key)
+            if cached is not None:
+                self._trace(current, normalized, time.perf_counter() - start_time)
+                return cached
+            prepared = await asyncio.to_thread(encode_audio, normalized, self.input_format)
+            if metered and self.metered:
+                await acharge("stt_seconds", self._seconds(prepared))
+            text, confidence = await self._atranscribe(io.BytesIO(prepared.data))
+            seconds = time.perf_counter() - start_time
+            self._trace(current, normalized, seconds, prepared)
+            return self._result(key, text, confidence, seconds)
+
+    def streaming_recognizer(self) -> StreamingRecognizer:
+        return BufferedStreamingRecognizer(self)
+
+
+class BufferedStreamingRecognizer(StreamingRecognizer):
+    """Collects the utterance and transcribes it with a whole-recording backend once the VAD ends it."""
+
+    def __init__(self, backend: SpeechToText, sample_rate: int = SAMPLE_RATE):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self._frames = []
+
+    def reset(self):
+        self._frames = []
+
+    def accept_frame(self, frame: bytes) -> str:
+        self._frames.append(frame)
+        return None
+
+    def final(self) -> str:
+        return self.backend.transcribe(pcm_to_wav(b"".join(self._frames), self.sample_rate)).text
+
+
+class AssemblyAISpeechToText(SpeechToText):
+    """AssemblyAI's best model: upload, then poll until the transcript is ready."""
+    name = "assemblyai"
+    metered = True
+    input_format = UPLOAD_FORMAT
+
+    def _transcribe(self, audio) -> tuple:
+        # stt configures the API key on import, only pay for that when this backend is used
+        from stt import transcribe_with_assemblyai
+
+        transcript = call_with_retry(transcribe_with_assemblyai, audio, name="assemblyai")
+        return transcript.text, transcript.confidence
+
+    async def _atranscribe(self, audio) -> tuple:
+        from stt import atranscribe_with_assemblyai
+
+        transcript = await acall_with_retry(atranscribe_with_assemblyai, audio, name="assemblyai")
+        return transcript.text, transcript.confidence
+
+
+class GoogleSpeechToText(SpeechToText):
+    """Google Web Speech API through the speech_recognition library."""
+    name = "google"
+    metered = True
+
+    def __init__(self):
+        if not SPEECH_RECOGNITION_AVAILABLE:
+            raise RuntimeError("speech_recognition not available. Install with: pip install SpeechRecognition")
+        self.recognizer = sr.Recognizer()
+
+    def _transcribe(self, audio) -> tuple:
+        with sr.AudioFile(audio) as source:
+            audio_data = self.recognizer.record(source)
+        try:
+            result = self.recognizer.recognize_google(audio_data, show_all=True)
+        except sr.UnknownValueError:
+            raise NoSpeechError("Google Web Speech could not understand the audio")
+        if not result:
+            raise NoSpeechError("Google Web Speech could not understand the audio")
+        best = result['alternative'][0]
+        return best.get('transcript', ''), best.get('confidence')
+
+
+class VoskSpeechToText(SpeechToText):
+    """
+    Local CPU recognition with Vosk, no network round trip. Needs a downloaded model
+    (VOSK_MODEL_PATH) and 16-bit mono PCM WAV input.
+    """
+    name = "vosk"
+
+    def __init__(self, model_path: str = None):
+        if not VOSK_AVAILABLE:
+            raise RuntimeError("vosk not available. Install with: pip install vosk")
+        self.model_path = model_path or get_secret("VOSK_MODEL_PATH")
+        if not self.model_path:
+            raise RuntimeError("Set VOSK_MODEL_PATH to a downloaded Vosk model directory")
+        # Loading a model takes a while, it is shared by every transcription and recognizer
+        self.model = vosk.Model(self.model_path)
+
+    def _transcribe(self, audio) -> tuple:
+        with wave.open(audio, 'rb') as wf:
+            if wf.getsampwidth() != SAMPLE_WIDTH or wf.getnchannels() != 1:
+                raise ValueError("Vosk needs 16-bit mono PCM WAV audio")
+            recognizer = vosk.KaldiRecognizer(self.model, wf.getframerate())
+            recognizer.SetWords(True)
+            words = []
+            while True:
+                data = wf.readframes(4000)
+                if not data:
+                    break
+                if recognizer.AcceptWaveform(data):
+                    words.extend(json.loads(recognizer.Result()).get('result', []))
+            words.extend(json.loads(recognizer.FinalResult()).get('result', []))
+
+        text = " ".join(word['word'] for word in words)
+        confidence = sum(word['conf'] for word in words) / len(words) if words else None
+        return text, confidence
+
+    def streaming_recognizer(self) -> StreamingRecognizer:
+        return VoskStreamingRecognizer(model=self.model)
+
+
+STT_BACKENDS = {
+    "assemblyai": AssemblyAISpeechToText,
+    "google": GoogleSpeechToText,
+    "vosk": VoskSpeechToText,
+}
+DEFAULT_STT_BACKEND = get_secret("STT_BACKEND", "google")
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_stt_backend(name: str = None) -> SpeechToText:
+    """Returns the (shared) backend instance, STT_BACKEND picks the default per deployment."""
+    name = name or DEFAULT_STT_BACKEND
+    if name not in STT_BACKENDS:
+        raise ValueError(f"Unknown STT backend: {name}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = STT_BACKENDS[name]()
+        return _backends[name]
+
+
+if __name__ == '__main__':
+    import sys
+    from stt import get_wav_duration
+
+    # python stt_backends.py <wav file> [backend ...]
+    audio_file_path = sys.argv[1] if len(sys.argv) > 1 else './data/audios/harvard.wav'
+    backend_names = sys.argv[2:] or list(STT_BACKENDS)
+    audio_length = get_wav_duration(audio_file_path)
+
+    for backend_name in backend_names:
+        try:
+            result = get_stt_backend(backend_name).transcribe(audio_file_path)
+            rtf = result.seconds / audio_length if audio_length else float('nan')
+            print(f"[{backend_name}] {result.seconds:.2f}s (RTF {rtf:.3f}), confidence {result.confidence}: {result.text}")
+        except Exception as e:
+            print(f"[{backend_name}] failed: {e}")
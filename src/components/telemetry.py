@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import numpy as np
+from config import get_secret
+
+try:
+    from opentelemetry import trace as otel_trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+TELEMETRY_ENABLED = str(get_secret("TELEMETRY_ENABLED", "true")).lower() in ("1", "true", "yes")
+# Spans are only written to disk when a path is configured, e.g. data/cache/telemetry.jsonl
+TELEMETRY_PATH = get_secret("TELEMETRY_PATH", None)
+# The file is rotated to <path>.1 at this size, so at most twice this is kept
+TELEMETRY_MAX_BYTES = int(get_secret("TELEMETRY_MAX_BYTES", 10 * 1024 * 1024))
+# Durations kept in memory per stage for the live p50/p95
+RECENT_SPANS_PER_STAGE = 1000
+
+_session_id = contextvars.ContextVar('telemetry_session_id', default=None)
+_query_hash = contextvars.ContextVar('telemetry_query_hash', default=None)
+_trace_id = contextvars.ContextVar('telemetry_trace_id', default=None)
+_span_id = contextvars.ContextVar('telemetry_span_id', default=None)
+
+
+def query_hash(text: str) -> str:
+    """Short stable hash of a query, so spans can be grouped without logging what users asked."""
+    return hashlib.sha256(" ".join(str(text).lower().split()).encode('utf-8')).hexdigest()[:16]
+
+
+class JSONLSink:
+    """
+    Appends one finished span per line, using OpenTelemetry's span field names.
+    Once the file reaches max_bytes it replaces the previous <path>.1 and a new file is started.
+    """
+
+    def __init__(self, path: str, max_bytes: int = TELEMETRY_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+
+    def export(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._rotate()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        except OSError as e:
+            print(f"Could not write telemetry: {e}")
+
+
+class Telemetry:
+    """
+    Collects spans for every stage of a request: exports them to the sink and keeps
+    recent durations per stage in memory for percentile summaries.
+    """
+
+    def __init__(self, sink=None, enabled: bool = True):
+        self.sink = sink
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=RECENT_SPANS_PER_STAGE))
+
+    def record(self, name: str, start_ns: int, end_ns: int, attributes: dict = None, status: str = "OK",
+               span_id: str = None, parent_span_id: str = None):
+        if not self.enabled:
+            return
+        duration_ms = (end_ns - start_ns) / 1e6
+        record = {
+            'name': name,
+            'trace_id': _trace_id.get(),
+            'span_id': span_id or uuid.uuid4().hex[:16],
+            'parent_span_id': parent_span_id if parent_span_id is not None else _span_id.get(),
+            'start_time_unix_nano': start_ns,
+            'end_time_unix_nano': end_ns,
+            'duration_ms': round(duration_ms, 3),
+            'status': status,
+            'attributes': {
+                'session.id': _session_id.get(),
+                'query.hash': _query_hash.get(),
+                **(attributes or {}),
+            },
+        }
+        with self._lock:
+            self._durations[name].append(duration_ms)
+        if self.sink is not None:
+            self.sink.export(record)
+
+    def percentiles(self) -> dict:
+        """{stage: {'count', 'p50_ms', 'p95_ms'}} over the recent spans of each stage."""
+        with self._lock:
+            durations = {name: list(values) for name, values in self._durations.items()}
+        return {
+            name: {'count': len(values), 'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95))}
+            for name, values in durations.items() if values
+        }
+
+
+# In-memory percentiles are always kept (the apps' latency panel), the file export is opt-in
+telemetry = Telemetry(JSONLSink(TELEMETRY_PATH) if TELEMETRY_PATH else None, enabled=TELEMETRY_ENABLED)
+
+
+@contextmanager
+def trace_context(session_id: str = None, query: str = None):
+    """Tags every span recorded inside the block with the session ID and the query's hash."""
+    tokens = [
+        (_trace_id, _trace_id.set(uuid.uuid4().hex)),
+        (_query_hash, _query_hash.set(query_hash(query) if query is not None else None)),
+    ]
+    if session_id is not None:
+        tokens.append((_session_id, _session_id.set(session_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def set_query(query: str):
+    """Tags the rest of the current trace with a query that only became known inside it (e.g. a transcript)."""
+    _query_hash.set(query_hash(query))
+
+
+class Span:
+    """Handle yielded by span(): attributes can be added while the stage runs."""
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block as one stage. Spans opened inside it become its children,
+    an exception marks it as an error and is re-raised.
+    """
+    current = Span(name, attributes)
+    parent_span_id = _span_id.get()
+    token = _span_id.set(current.span_id)
+    status = "OK"
+    start_ns = time.time_ns()
+    otel_span = otel_trace.get_tracer(__name__).start_span(name) if OTEL_AVAILABLE and telemetry.enabled else None
+    try:
+        yield current
+    except BaseException as e:
+        status = "ERROR"
+        current.set(**{'exception.type': type(e).__name__})
+        raise
+    finally:
+        end_ns = time.time_ns()
+        _span_id.reset(token)
+        telemetry.record(name, start_ns, end_ns, current.attributes, status,
+                         span_id=current.span_id, parent_span_id=parent_span_id)
+        if otel_span is not None:
+            # Mirrors the span into an OpenTelemetry SDK if the deployment configured one
+            otel_span.set_attributes({key: value for key, value in current.attributes.items()
+                                      if isinstance(value, (str, bool, int, float))})
+            otel_span.end()
+
+
+def record_span(name: str, start_ns: int, end_ns: int = None, **attributes):
+    """Records a stage timed by the caller, for stages that can't be wrapped in a with block (generators)."""
+    telemetry.record(name, start_ns, end_ns or time.time_ns(), attributes)
+
+
+def summarize_file(path: str) -> dict:
+    """Per-stage p50/p95 over every span in a telemetry JSONL file."""
+    durations = defaultdict(list)
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                durations[record['name']].append(record['duration_ms'])
+    return {
+        name: {'count': len(values), 'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95))}
+        for name, values in durations.items()
+    }
+
+
+if __name__ == '__main__':
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else TELEMETRY_PATH
+    if not path:
+        sys.exit("Usage: python telemetry.py <telemetry.jsonl> (or set TELEMETRY_PATH)")
+    summary = summarize_file(path)
+    print(f"{'stage':<24}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}")
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['p95_ms']):
+        print(f"{name:<24}{stats['count']:>8}{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}")
@@ -0,0 +1,397 @@
+import io
+import os
+import re
+import json
+import wave
+import hashlib
+import uuid
+import atexit
+import asyncio
+import tempfile
+import contextvars
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FuturesTimeoutError
+from cache import LRUCache
+from config import get_secret
+from telemetry import span
+from quota import charge
+
+try:
+    import pyttsx3
+    PYTTSX3_AVAILABLE = True
+except ImportError:
+    PYTTSX3_AVAILABLE = False
+
+try:
+    from gtts import gTTS
+    GTTS_AVAILABLE = True
+except ImportError:
+    GTTS_AVAILABLE = False
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;:])\s+|\n+')
+# Very short sentences are merged with the next one, each synthesis call has a fixed overhead
+MIN_CHUNK_CHARS = 40
+
+_tts_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tts")
+
+AUDIO_FORMATS = {
+    "gtts": "audio/mp3",
+    "pyttsx3": "audio/wav",
+}
+# gTTS returns 32 kbps mono MP3
+GTTS_BITRATE = 32000
+
+# Everything that changes the synthesized audio, part of the cache key
+ENGINE_SETTINGS = {
+    "gtts": {"lang": "en"},
+    "pyttsx3": {"rate": 150, "volume": 0.9, "voice_names": ("male", "david")},
+}
+
+
+def clean_text_for_speech(text: str) -> str:
+    return text.replace("❌", "Error:").replace("✅", "Success:").replace("📦", "").replace("🤖", "")
+
+
+class AudioCache:
+    """
+    Content-addressed cache of synthesized audio: an in-memory LRU in front of a
+    directory of files, both evicted least-recently-used first under a byte budget.
+    Keys are hashes of the cleaned text, the engine and its settings.
+    """
+
+    def __init__(self, cache_dir: str, max_memory_bytes: int, max_disk_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = LRUCache(max_entries=10_000, max_bytes=max_memory_bytes, sizeof=len)
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None
+
+    @staticmethod
+    def key(text: str, engine: str, **settings) -> str:
+        payload = json.dumps([clean_text_for_speech(text).strip(), engine, settings], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.audio")
+
+    def get(self, key: str) -> bytes:
+        audio = self._memory.get(key)
+        if audio is not None:
+            return audio
+        try:
+            with open(self._path(key), 'rb') as f:
+                audio = f.read()
+            os.utime(self._path(key))  # mark as recently used for disk eviction
+        except OSError:
+            return None
+        self._memory.set(key, audio)
+        return audio
+
+    def set(self, key: str, audio: bytes):
+        self._memory.set(key, audio)
+        if self.max_disk_bytes <= 0:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(audio)
+            os.replace(temp_path, self._path(key))
+            with self._disk_lock:
+                if self._disk_bytes is not None:
+                    self._disk_bytes += len(audio)
+                self._evict_disk()
+        except OSError as e:
+            print(f"Could not write TTS cache entry: {e}")
+
+    def _evict_disk(self):
+        if self._disk_bytes is not None and self._disk_bytes <= self.max_disk_bytes:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.audio'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+        self._disk_bytes = total
+
+
+audio_cache = AudioCache(
+    cache_dir=get_secret("TTS_CACHE_DIR", "data/cache/tts"),
+    max_memory_bytes=int(get_secret("TTS_CACHE_MEMORY_BYTES", 32 * 1024 * 1024)),
+    max_disk_bytes=int(get_secret("TTS_CACHE_DISK_BYTES", 256 * 1024 * 1024))
+)
+
+
+def synthesize_gtts(text: str, lang: str = 'en') -> bytes:
+    """Generate MP3 audio using Google Text-to-Speech"""
+    if not GTTS_AVAILABLE:
+        raise RuntimeError("gTTS not available. Install with: pip install gtts")
+
+    tts = gTTS(text=clean_text_for_speech(text), lang=lang, slow=False)
+    audio_buffer = io.BytesIO()
+    tts.write_to_fp(audio_buffer)
+    return audio_buffer.getvalue()
+
+
+def _select_voice(engine, voice_names: tuple):
+    voices = engine.getProperty('voices')
+    if voices:
+        for voice in voices:
+            if any(name in voice.name.lower() for name in voice_names):
+                engine.setProperty('voice', voice.id)
+                break
+
+
+def _offline_tts_worker(jobs, results, rate: int, volume: float, voice_names: tuple):
+    """
+    Worker process loop: one pyttsx3 engine, initialised once, renders every job.
+    pyttsx3 can only render to a file, so each job gets its own file in a private directory.
+    """
+    engine = pyttsx3.init()
+    engine.setProperty('rate', rate)
+    engine.setProperty('volume', volume)
+    _select_voice(engine, voice_names)
+
+    work_dir = tempfile.mkdtemp(prefix="offline-tts-")
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, text = job
+        audio_path = os.path.join(work_dir, f"{job_id}.wav")
+        try:
+            engine.save_to_file(text, audio_path)
+            engine.runAndWait()
+            with open(audio_path, "rb") as audio_file:
+                results.put((job_id, audio_file.read(), None))
+        except Exception as e:
+            results.put((job_id, None, str(e)))
+        finally:
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+
+
+class OfflineTTSWorker:
+    """
+    A long-lived process running pyttsx3, fed synthesis jobs over a queue.
+    Callers from any thread get WAV bytes back; the process is (re)started on demand.
+    """
+
+    def __init__(self, rate: int, volume: float, voice_names: tuple, timeout: float = 60):
+        self.settings = (rate, volume, voice_names)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._process = None
+        self._jobs = None
+        self._pending = {}
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            context = multiprocessing.get_context("spawn")
+            self._jobs = context.Queue()
+            results = context.Queue()
+            self._process = context.Process(target=_offline_tts_worker, args=(self._jobs, results, *self.settings),
+                                            name="offline-tts", daemon=True)
+            self._process.start()
+            threading.Thread(target=self._dispatch, args=(results,), name="offline-tts-results", daemon=True).start()
+
+    def _dispatch(self, results):
+        while True:
+            job_id, audio, error = results.get()
+            future = self._pending.pop(job_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"Offline TTS failed: {error}"))
+            else:
+                future.set_result(audio)
+
+    def synthesize(self, text: str) -> bytes:
+        self._ensure_running()
+        job_id = uuid.uuid4().hex
+        future = Future()
+        self._pending[job_id] = future
+        self._jobs.put((job_id, text))
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            self._pending.pop(job_id, None)
+            if not self._process.is_alive():
+                print("Offline TTS worker died, it will be restarted on the next request")
+            raise RuntimeError("Offline TTS timed out")
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                self._jobs.put(None)
+                self._process.join(timeout=5)
+            self._process = None
+
+
+_offline_workers = {}
+_offline_workers_lock = threading.Lock()
+
+
+@atexit.register
+def _stop_offline_workers():
+    for worker in _offline_workers.values():
+        worker.stop()
+
+
+def synthesize_pyttsx3(text: str, rate: int = 150, volume: float = 0.9, voice_names: tuple = ("male", "david")) -> bytes:
+    """Generate WAV audio using pyttsx3 (offline) in the persistent worker process"""
+    if not PYTTSX3_AVAILABLE:
+        raise RuntimeError("pyttsx3 not available. Install with: pip install pyttsx3")
+
+    settings = (rate, volume, tuple(voice_names))
+    with _offline_workers_lock:
+        if settings not in _offline_workers:
+            _offline_workers[settings] = OfflineTTSWorker(*settings)
+        worker = _offline_workers[settings]
+    return worker.synthesize(clean_text_for_speech(text))
+
+
+SYNTHESIZERS = {
+    "gtts": synthesize_gtts,
+    "pyttsx3": synthesize_pyttsx3,
+}
+# Engines calling a remote service, their characters count against the TTS quota
+METERED_ENGINES = ("gtts",)
+# Speech is optional, don't hold an answer back waiting for TTS budget
+TTS_QUOTA_WAIT_SECONDS = 2
+
+
+def synthesize(text: str, engine: str = "gtts") -> bytes:
+    """Synthesizes text with the engine's configured settings, serving repeats from the audio cache."""
+    if engine not in SYNTHESIZERS:
+        raise ValueError(f"Unknown TTS engine: {engine}")
+
+    settings = ENGINE_SETTINGS[engine]
+    key = AudioCache.key(text, engine, **settings)
+    with span("tts", engine=engine, characters=len(text)) as current:
+        audio = audio_cache.get(key)
+        current.set(cached=audio is not None)
+        if audio is None:
+            if engine in METERED_ENGINES:
+                charge("tts_characters", len(text), max_wait=TTS_QUOTA_WAIT_SECONDS)
+            audio = SYNTHESIZERS[engine](text, **settings)
+            if audio:
+                audio_cache.set(key, audio)
+    return audio
+
+
+async def asynthesize(text: str, engine: str = "gtts") -> bytes:
+    # Both engines are blocking libraries, keep them off the event loop
+    return await asyncio.to_thread(synthesize, text, engine)
+
+
+def audio_seconds(audio: bytes, engine: str = "gtts") -> float:
+    """Playback length of synthesized audio, used to play chunks one after another."""
+    if AUDIO_FORMATS.get(engine) == "audio/wav":
+        with wave.open(io.BytesIO(audio), 'rb') as wav:
+            return wav.getnframes() / wav.getframerate()
+    return len(audio) * 8 / GTTS_BITRATE
+
+
+def join_audio(parts: list, engine: str = "gtts") -> bytes:
+    """Concatenates synthesized chunks into one playable file."""
+    parts = [part for part in parts if part]
+    if len(parts) <= 1:
+        return parts[0] if parts else b""
+    if AUDIO_FORMATS.get(engine) != "audio/wav":
+        # MP3 is a stream of self-contained frames, chunks can simply be appended
+        return b"".join(parts)
+
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as joined:
+        for index, part in enumerate(parts):
+            with wave.open(io.BytesIO(part), 'rb') as chunk:
+                if index == 0:
+                    joined.setparams(chunk.getparams())
+                joined.writeframes(chunk.readframes(chunk.getnframes()))
+    return output.getvalue()
+
+
+class IncrementalSpeaker:
+    """
+    Synthesizes an answer sentence by sentence while its text is still being produced.
+
+    Feed it text as it streams in (or wrap the stream with `wrap`); every completed
+    sentence is sent to the TTS thread pool straight away, so by the time the text
+    is complete only the last sentence is still being synthesized.
+    """
+
+    def __init__(self, engine: str = "gtts", min_chars: int = MIN_CHUNK_CHARS):
+        self.engine = engine
+        self.min_chars = min_chars
+        self._buffer = ""
+        self._futures = []
+        self._delivered = 0
+
+    def _submit(self, text: str):
+        # Run in a copy of the caller's context so the TTS spans stay on its trace
+        context = contextvars.copy_context()
+        self._futures.append(_tts_executor.submit(context.run, synthesize, text, self.engine))
+
+    def feed(self, text: str):
+        self._buffer += text
+        pieces = SENTENCE_BOUNDARY.split(self._buffer)
+        # The last piece may be an unfinished sentence, keep it buffered
+        self._buffer = pieces.pop()
+        pending = ""
+        for piece in pieces:
+            pending = f"{pending} {piece.strip()}".strip()
+            if len(pending) >= self.min_chars:
+                self._submit(pending)
+                pending = ""
+        if pending:
+            self._buffer = f"{pending} {self._buffer}"
+
+    def wrap(self, chunks):
+        """Passes a text stream through unchanged, feeding it to the speaker on the way."""
+        for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+
+    def _flush(self):
+        if self._buffer.strip():
+            self._submit(self._buffer.strip())
+            self._buffer = ""
+
+    def _next_audio(self) -> bytes:
+        # Counted as delivered first, a failed chunk is skipped rather than raised again
+        future = self._futures[self._delivered]
+        self._delivered += 1
+        return future.result()
+
+    def ready_audio(self):
+        """Yields the audio of the chunks finished since the last call, in order, without waiting."""
+        while self._delivered < len(self._futures) and self._futures[self._delivered].done():
+            yield self._next_audio()
+
+    def iter_audio(self):
+        """Yields the audio of every chunk not yet handed out, in order, as soon as it is ready."""
+        self._flush()
+        while self._delivered < len(self._futures):
+            yield self._next_audio()
+
+    def finish(self) -> bytes:
+        """Waits for the remaining chunks and returns the whole answer as one audio file."""
+        self._flush()
+        return join_audio([future.result() for future in self._futures], self.engine)
+
+
+def synthesize_chunked(text: str, engine: str = "gtts") -> bytes:
+    """Synthesizes the sentences of a complete text in parallel and joins them."""
+    speaker = IncrementalSpeaker(engine)
+    speaker.feed(text)
+    return speaker.finish()
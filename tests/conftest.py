@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The components import each other as top-level modules and read data/ relative to the repo root
+sys.path.insert(0, os.path.join(ROOT, 'src', 'components'))
+os.chdir(ROOT)
+# Building the Gemini clients on import needs a key, no calls are made by the tests
+os.environ.setdefault('GEMINI_API_KEY', 'test-key')
@@ -0,0 +1,41 @@
+import pytest
+from answer_cache import AnswerCache
+
+
+@pytest.fixture
+def cache():
+    return AnswerCache(max_entries=16, ttl_seconds=60, similarity_threshold=0.8)
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Which items in the QC Lab are damaged?", "Which items in the QC Lab are not damaged?"),
+    ("How many units of Bonderite 6278", "How many damaged units of Bonderite 6278"),
+    ("Which safety tools in the QC Lab need protective goggles",
+     "Which safety tools in the QC Lab do not need protective goggles"),
+    ("Which safety tools in the QC Lab need protective goggles",
+     "Which safety tools in the QC Lab don't need protective goggles"),
+    ("How many units of the Loctite adhesive are stored in the QC Lab with good condition",
+     "How many units of the Loctite adhesive are stored in the QC Lab with used condition"),
+    ("Total quantity of Bonderite 6278", "Total quantity of Bonderite 9149"),
+    ("How many units of every Loctite adhesive are stored in the QC Lab and are in active use",
+     "How many units of every Technomelt adhesive are stored in the QC Lab and are in active use"),
+    ("How many units of every Loctite adhesive are stored in the QC Lab and are in active use",
+     "How many units of every Henkel adhesive are stored in the QC Lab and are in active use"),
+    ("Which dispensing tools stored in the QC Lab need goggles as PPE before anyone can use them",
+     "Which dispensing tools stored in the QC Lab need gloves as PPE before anyone can use them"),
+    ("For the curing equipment in the main lab that is in active use give me the SOP link",
+     "For the curing equipment in the main lab that is in active use give me the SOP available"),
+])
+def test_qualifiers_must_match(cache, cached, asked):
+    cache.set(cached, "cached answer")
+    assert cache.get(asked) is None
+
+
+def test_similar_phrasing_is_reused(cache):
+    cache.set("Which items in the QC Lab are damaged?", "cached answer")
+    assert cache.get("Show me which items in QC Lab are currently damaged") == "cached answer"
+
+
+def test_filler_words_are_ignored(cache):
+    cache.set("Please list all the damaged adhesive items kept in the QC Lab", "cached answer")
+    assert cache.get("Please list the damaged adhesive items kept in the QC Lab") == "cached answer"
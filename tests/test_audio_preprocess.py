@@ -0,0 +1,35 @@
+import wave
+import io
+from audio_preprocess import prepare_for_stt, TARGET_SAMPLE_RATE
+
+AUDIO_PATH = 'data/audios/harvard.wav'
+
+
+def test_wav_is_preprocessed_without_ffmpeg():
+    prepared = prepare_for_stt(AUDIO_PATH, "wav")
+    assert prepared.format == "wav"
+    assert prepared.seconds > 0
+    assert len(prepared.data) < prepared.original_bytes
+    with wave.open(io.BytesIO(prepared.data), 'rb') as wav:
+        assert wav.getnchannels() == 1
+        assert wav.getframerate() == TARGET_SAMPLE_RATE
+
+
+def test_transcript_cache_hit_skips_encoding(monkeypatch):
+    import stt_backends
+
+    class FlacBackend(stt_backends.SpeechToText):
+        name = "flac-test"
+        input_format = "flac"
+
+        def _transcribe(self, audio) -> tuple:
+            return "the stale smell of old beer", 0.9
+
+    encodes = []
+    encode_audio = stt_backends.encode_audio
+    monkeypatch.setattr(stt_backends, 'encode_audio', lambda *args: encodes.append(args) or encode_audio(*args))
+    backend = FlacBackend()
+    first = backend.transcribe(AUDIO_PATH)
+    with open(AUDIO_PATH, 'rb') as f:
+        assert backend.transcribe(f.read()) is first
+    assert len(encodes) == 1
@@ -0,0 +1,40 @@
+import pytest
+from fast_path import match_intent, answer_fast_path
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What is the total count of Bonderite 6278?", ('count', {'item_name': 'Bonderite 6278'})),
+    ("How many units of Loctite 9302 do we have?", ('count', {'item_name': 'Loctite 9302'})),
+    ("Where is Bonderite 6278 located?", ('location', {'item_name': 'Bonderite 6278'})),
+    ("What is the model number of Bonderite 6278?", ('model_number', {'item_name': 'Bonderite 6278'})),
+    ("What are the top 5 products present in the R&D dept. with quantity?",
+     ('top_products', {'top_n': 5, 'location': 'R&D Dept.'})),
+    ("top 3 products in QC Lab", ('top_products', {'top_n': 3, 'location': 'QC Lab'})),
+    ("top products", ('top_products', {'top_n': 5, 'location': None})),
+])
+def test_supported_questions(question, expected):
+    assert match_intent(question) == expected
+
+
+@pytest.mark.parametrize("question", [
+    # Filters the fast path can't apply
+    "How many Bonderite 6278 are damaged?",
+    "How many Bonderite 6278 are in the QC Lab?",
+    "quantity of Technomelt 1623 that is not damaged",
+    "top 3 products of type Adhesive",
+    "Show the top 5 Loctite products",
+    # Unknown location
+    "Top 5 products in the Warehouse 9",
+    # Not a product ranking
+    "Which location has the top quantity?",
+    "top 0 products",
+    "Do we have any adhesives available for rubber tyres? If yes, where is it kept in the inventory?",
+])
+def test_unsupported_questions_go_to_the_llm(question):
+    assert match_intent(question) is None
+    assert answer_fast_path(question) is None
+
+
+def test_count_answer_uses_the_inventory():
+    response = answer_fast_path("What is the total count of Bonderite 6278?")
+    assert response.paraphrased_output.startswith("There are a total of 82 units of Bonderite 6278")
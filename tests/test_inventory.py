@@ -0,0 +1,42 @@
+import pytest
+import pandas as pd
+from inventory import InventoryStore, inventory_store
+from agent import agent_pool
+
+
+def test_repl_namespace_cannot_modify_the_shared_inventory():
+    total = inventory_store.get_df()['Quantity'].sum()
+    with agent_pool.checkout() as agent:
+        repl = next(agent_tool for agent_tool in agent.tools if hasattr(agent_tool, 'locals'))
+        repl.run("idx.df['Quantity'] = 0")
+        assert "read-only" in repl.run("idx.quantity[:] = 0")
+        assert "read-only" in repl.run("idx.positions['Item Name']['bonderite 6278'][:] = 0")
+        assert repl.locals['idx'].df is repl.locals['df']
+
+    assert inventory_store.get_df()['Quantity'].sum() == total
+    assert inventory_store.get_index().quantity.sum() == total
+
+
+def test_shared_index_is_read_only():
+    index = inventory_store.get_index()
+    with pytest.raises(ValueError):
+        index.quantity[0] = 0
+    with pytest.raises(TypeError):
+        index.labels['Item Name']['new item'] = 'New Item'
+
+
+def test_unwritable_snapshot_parses_once_and_types_like_a_snapshot(tmp_path, monkeypatch):
+    reference = InventoryStore(snapshot_dir=str(tmp_path / 'writable')).get_df()
+
+    def read_only(*args, **kwargs):
+        raise OSError("read-only file system")
+
+    parses = []
+    read_excel = pd.read_excel
+    monkeypatch.setattr(InventoryStore, '_write_snapshot', read_only)
+    monkeypatch.setattr(pd, 'read_excel', lambda *args, **kwargs: parses.append(1) or read_excel(*args, **kwargs))
+    df = InventoryStore(snapshot_dir=str(tmp_path / 'read-only')).get_df()
+
+    assert len(parses) == 1
+    assert df.dtypes.equals(reference.dtypes)
+    assert df.equals(reference)
@@ -0,0 +1,53 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from quota import QuotaManager, quota, quota_user
+from pipeline import StreamedAnswer
+
+
+def test_user_and_global_buckets_both_apply():
+    manager = QuotaManager({'tokens': {'global': 60, 'user': 30}})
+    assert manager.try_consume('tokens', 25, 'a').allowed
+    assert not manager.try_consume('tokens', 10, 'a').allowed
+    assert manager.try_consume('tokens', 25, 'b').allowed
+    # The global bucket is nearly empty even though c hasn't used anything
+    assert not manager.try_consume('tokens', 20, 'c').allowed
+
+
+def test_settle_refunds_unused_reservation():
+    manager = QuotaManager({'tokens': {'global': 60, 'user': 30}})
+    manager.try_consume('tokens', 25, 'a')
+    manager.settle('tokens', 25, 5, 'a')
+    assert manager.try_consume('tokens', 20, 'a').allowed
+
+
+def test_async_waiters_do_not_hold_executor_threads():
+    manager = QuotaManager({'tokens': {'global': 600, 'user': 600}})
+    manager.try_consume('tokens', 600, 'a')
+
+    async def main():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        waiters = [asyncio.create_task(manager.aacquire('tokens', 5, 'a', max_wait=5)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: 'free'), timeout=0.3) == 'free'
+        return await asyncio.gather(*waiters)
+
+    assert all(admission.allowed for admission in asyncio.run(main()))
+    assert manager.stats['queued'] == 3
+
+
+class Cancelled(Exception):
+    pass
+
+
+def cancel(status):
+    raise Cancelled(status)
+
+
+def test_reservation_is_returned_when_preparing_fails():
+    with quota_user('test-cancelled-request'):
+        before = quota.usage()['gemini_tokens']['user']
+        answer = StreamedAnswer("Which items in the QC Lab are damaged?", on_status=cancel)
+        with pytest.raises(Cancelled):
+            answer.prepare()
+        assert quota.usage()['gemini_tokens']['user'] == pytest.approx(before, abs=1e-3)
@@ -0,0 +1,47 @@
+import numpy as np
+from streaming_stt import EnergyVAD, SAMPLE_RATE, FRAME_MS, transcribe_stream
+from stt_backends import SpeechToText
+
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+rng = np.random.default_rng(0)
+
+
+def frame(level: float) -> bytes:
+    return (rng.normal(0, level, FRAME_SAMPLES)).clip(-32768, 32767).astype(np.int16).tobytes()
+
+
+def test_speech_from_the_first_frame_is_still_detected():
+    vad = EnergyVAD()
+    talking = [vad.is_speech(frame(3000)) for _ in range(100)]
+    pause = [vad.is_speech(frame(50)) for _ in range(20)]
+    talking_again = [vad.is_speech(frame(3000)) for _ in range(20)]
+    assert all(talking[vad.calibration_frames:])
+    assert not any(pause)
+    assert all(talking_again)
+
+
+def test_background_noise_is_learned():
+    vad = EnergyVAD()
+    background = [vad.is_speech(frame(500)) for _ in range(50)]
+    assert not any(background[vad.calibration_frames:])
+    assert vad.is_speech(frame(4000))
+
+
+class CountingBackend(SpeechToText):
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+
+    def _transcribe(self, audio) -> tuple:
+        self.calls += 1
+        return "where is bonderite", 0.9
+
+
+def test_streamed_utterances_go_through_the_backend_and_its_cache():
+    backend = CountingBackend()
+    utterance = [frame(50)] * 10 + [frame(3000)] * 30 + [frame(50)] * 30
+    for _ in range(2):
+        text = transcribe_stream(iter(utterance), backend.streaming_recognizer(), vad=EnergyVAD())
+        assert text == "where is bonderite"
+    assert backend.calls == 1
@@ -0,0 +1,25 @@
+import stt
+import stt_backends
+from quota import quota
+
+AUDIO_PATH = 'data/audios/harvard.wav'
+
+
+class MeteredBackend(stt_backends.SpeechToText):
+    name = "metered-test"
+    metered = True
+
+    def _transcribe(self, audio) -> tuple:
+        return "the stale smell of old beer", 0.9
+
+
+def test_batch_is_not_charged_to_the_stt_quota(monkeypatch):
+    monkeypatch.setitem(stt_backends.STT_BACKENDS, MeteredBackend.name, MeteredBackend)
+    # Leave the batch's (anonymous) budget empty, a metered call would queue and then fail
+    quota.try_consume("stt_seconds", quota.resources["stt_seconds"]["user"])
+
+    record = stt._transcribe_for_batch(AUDIO_PATH, MeteredBackend.name)
+
+    assert record['error'] is None
+    assert record['text'] == "the stale smell of old beer"
+    assert record['latency'] < 5